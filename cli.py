@@ -1,25 +1,622 @@
+from datetime import datetime
+from pathlib import Path
+
 import typer
 from rich.console import Console
 
-from tools.zangov.ingest_pg import ingest_all
+from tools.zangov.enums import Language, StorageMode
 
 app = typer.Typer(help="qaz-law CLI")
 console = Console()
 
 
+def metrics_dashboard(snapshot: dict):
+    """Tables of a `metrics` snapshot: progress, requests by endpoint, stages."""
+    from rich.console import Group
+    from rich.table import Table
+
+    def values(kind: str, name: str, label: str | None = None) -> dict:
+        return {m["labels"].get(label): m for m in snapshot[kind] if m["name"] == name}
+
+    counters = {}
+    for m in snapshot["counters"]:
+        counters.setdefault(m["name"], {})[tuple(m["labels"].items())] = m["value"]
+    gauges = {m["name"]: m["value"] for m in snapshot["gauges"] if not m["labels"]}
+    acts = values("counters", "acts_total", "result")
+    frontier = values("gauges", "frontier_acts", "state")
+    uptime = snapshot["uptime"]
+
+    progress = Table.grid(padding=(0, 2))
+    progress.add_row(
+        f"[bold]{uptime // 3600:.0f}h {uptime % 3600 // 60:02.0f}m[/bold]",
+        "acts " + ", ".join(f"{r} {int(m['value'])}" for r, m in sorted(acts.items())),
+        f"versions {int(sum(counters.get('versions_total', {}).values()))}",
+        f"workers busy {int(gauges.get('workers_busy', 0))}",
+        f"requests in flight {int(gauges.get('http_requests_in_flight', 0))}",
+        f"db connections {int(gauges.get('db_connections_in_use', 0))}",
+        f"crawler queue {int(gauges.get('crawler_queue_depth', 0))}",
+        "frontier "
+        + ", ".join(f"{s} {int(m['value'])}" for s, m in sorted(frontier.items())),
+    )
+
+    requests = Table(
+        "endpoint", "requests", "p50, s", "p95, s", "MB", "404", "retries", "errors"
+    )
+    downloaded = values("counters", "http_response_bytes_total", "endpoint")
+    retries = values("counters", "http_retries_total", "endpoint")
+    for endpoint, h in values("histograms", "http_request_seconds", "endpoint").items():
+        statuses = {
+            dict(labels)["status"]: n
+            for labels, n in counters.get("http_responses_total", {}).items()
+            if dict(labels)["endpoint"] == endpoint
+        }
+        errors = sum(
+            n
+            for labels, n in counters.get("http_errors_total", {}).items()
+            if dict(labels)["endpoint"] == endpoint
+        )
+        requests.add_row(
+            endpoint,
+            str(h["count"]),
+            f"{h['p50']:.2f}",
+            f"{h['p95']:.2f}",
+            f"{downloaded.get(endpoint, {}).get('value', 0) / 1024**2:.1f}",
+            str(int(statuses.get("404", 0))),
+            str(int(retries.get(endpoint, {}).get("value", 0))),
+            str(int(errors)),
+        )
+
+    stages = Table("stage", "count", "total, s", "mean, ms", "p95, ms")
+    for stage, h in values("histograms", "stage_seconds", "stage").items():
+        stages.add_row(
+            stage,
+            str(h["count"]),
+            f"{h['sum']:.1f}",
+            f"{h['sum'] / h['count'] * 1000:.1f}",
+            f"{h['p95'] * 1000:.0f}",
+        )
+    return Group(progress, requests, stages)
+
+
 @app.command()
 def ingest(
     recreate: bool = typer.Option(False, "--recreate", "-r"),
-    start_page: int = typer.Option(1, "--start-page", "-s"),
+    start_page: int | None = typer.Option(
+        None,
+        "--start-page",
+        "-s",
+        help="Walk the listing from this page instead of resuming the crawl",
+    ),
     workers: int = typer.Option(2, "--workers", "-w"),
+    fan_out: int = typer.Option(
+        8, "--fan-out", "-f", help="Max requests in flight for a single act"
+    ),
+    prefetch: int = typer.Option(
+        4, "--prefetch", "-p", help="Search pages requested ahead of the workers"
+    ),
+    incremental: bool = typer.Option(
+        False, "--incremental", "-i", help="Add new versions to ingested acts"
+    ),
+    storage_mode: StorageMode = typer.Option(
+        StorageMode.TEXT, "--storage", help="How version content is stored"
+    ),
+    use_async: bool = typer.Option(
+        False,
+        "--async",
+        "-a",
+        help="Use asyncio, --workers is a number of acts in flight",
+    ),
+    concurrency: int = typer.Option(
+        200, "--concurrency", "-c", help="Max requests in flight with --async"
+    ),
+    max_rate: float = typer.Option(
+        100, "--max-rate", help="Upper bound of the adaptive request rate, req/s"
+    ),
+    cache_dir: Path | None = typer.Option(
+        None, "--cache-dir", help="Cache API responses in this directory"
+    ),
+    cache_size: float = typer.Option(20, "--cache-size", help="Cache size limit in GB"),
+    replay: bool = typer.Option(
+        False, "--replay", help="Serve every request from the cache, offline"
+    ),
+    strict: bool = typer.Option(
+        False, "--strict", help="Validate responses against the full API schema"
+    ),
+    memory_budget: int | None = typer.Option(
+        None,
+        "--memory-budget",
+        help="Limit of the response bytes of pages waiting to be encoded and of "
+        "encoded content, held by all workers, in MB, 512 by default. Parsed "
+        "pages take several times their response size. Not with --async",
+    ),
+    api_url: str | None = typer.Option(
+        None, "--api-url", help="Base URL of the API, e.g. of the mock-server"
+    ),
+    metrics_file: Path | None = typer.Option(
+        None,
+        "--metrics-file",
+        help="Write metrics here, a Prometheus textfile for .prom, JSON otherwise",
+    ),
+    metrics_interval: float = typer.Option(
+        15, "--metrics-interval", help="Seconds between metrics writes"
+    ),
+    dashboard: bool = typer.Option(
+        False, "--dashboard", help="Show live request and stage metrics"
+    ),
+    profile: bool = typer.Option(
+        False, "--profile", help="Profile with cProfile and trace allocations, slow"
+    ),
+    profile_sample: float | None = typer.Option(
+        None,
+        "--profile-sample",
+        help="Sample the stacks of all threads N times per second",
+    ),
+    profile_dir: Path = typer.Option(
+        Path("profile"), "--profile-dir", help="Directory of the profiling output"
+    ),
+    pool_size: int | None = typer.Option(
+        None,
+        "--pool-size",
+        envvar="QAZ_LAW_POOL_SIZE",
+        help="Database connections kept open, by default one per worker and 3 more",
+    ),
+    max_overflow: int | None = typer.Option(
+        None,
+        "--max-overflow",
+        envvar="QAZ_LAW_MAX_OVERFLOW",
+        help="Connections opened over the pool size when all are in use",
+    ),
+    prepare_threshold: int | None = typer.Option(
+        None,
+        "--prepare-threshold",
+        help="Runs of a statement before it is prepared, 0 always, -1 never, "
+        "2 by default",
+    ),
 ):
+    from contextlib import ExitStack
+
+    from tools.zangov import client, metrics, models, storage
+
+    if use_async and memory_budget is not None:
+        # the async pipeline merges whole versions in memory
+        console.print("[bold red]--memory-budget does not apply to --async.[/bold red]")
+        raise typer.Exit(1)
+    if prepare_threshold is None:
+        prepare_threshold = models.DEFAULT_PREPARE_THRESHOLD
+    models.configure(
+        size=pool_size,
+        overflow=max_overflow,
+        prepare=prepare_threshold if prepare_threshold >= 0 else None,
+    )
+    client.limiter.max_rate = max_rate
+    client.strict = strict
+    storage.configure(storage_mode)
+    cache = None
+    if cache_dir or replay:
+        from tools.zangov.cache import DEFAULT_CACHE_DIR, ResponseCache
+
+        cache = ResponseCache(
+            cache_dir or DEFAULT_CACHE_DIR, max_bytes=int(cache_size * 1024**3)
+        )
+        console.print(
+            f"Response cache: {cache.root} ({len(cache)} entries)"
+            + (", [bold]replay[/bold]" if replay else "")
+        )
+    if cache is not None or api_url:
+        client.configure(cache, replay_only=replay, api_url=api_url)
+
     console.print("[bold green]Starting ingest...[/bold green]")
-    ingest_all(recreate=recreate, start_page=start_page, max_workers=workers)
+    with ExitStack() as stack:
+        if profile or profile_sample:
+            from tools.zangov import profiling
+
+            if profile:
+                stack.enter_context(profiling.profile(profile_dir))
+            if profile_sample:
+                stack.enter_context(profiling.sample(profile_dir, profile_sample))
+        if metrics_file:
+            stack.enter_context(metrics.Exporter(metrics_file, metrics_interval))
+        if dashboard:
+            from rich.live import Live
+
+            stack.enter_context(
+                Live(
+                    get_renderable=lambda: metrics_dashboard(
+                        metrics.registry.snapshot()
+                    ),
+                    console=console,
+                    refresh_per_second=1,
+                )
+            )
+        if use_async:
+            from tools.zangov import ingest_async
+
+            ingest_async.ingest_all(
+                recreate=recreate,
+                start_page=start_page,
+                max_acts=workers,
+                concurrency=concurrency,
+                fan_out=fan_out,
+                prefetch=prefetch,
+                incremental=incremental,
+            )
+        else:
+            from tools.zangov.budget import DEFAULT_LIMIT
+            from tools.zangov.ingest_pg import ingest_all
+
+            ingest_all(
+                recreate=recreate,
+                start_page=start_page,
+                max_workers=workers,
+                fan_out=fan_out,
+                prefetch=prefetch,
+                incremental=incremental,
+                memory_budget=memory_budget * 1024**2
+                if memory_budget is not None
+                else DEFAULT_LIMIT,
+            )
     console.print("[bold green]Data ingest completed successfully.[/bold green]")
 
 
+@app.command()
+def zstd_train(
+    samples: int = typer.Option(2000, "--samples", help="Act versions to sample"),
+    dict_size: int = typer.Option(112_640, "--dict-size", help="Dictionary size"),
+):
+    """Train a zstd dictionary on the corpus for --storage zstd."""
+    from tools.zangov import zdict
+    from tools.zangov.ingest_pg import init_db
+
+    init_db()
+    dict_id, samples_count = zdict.train(samples=samples, dict_size=dict_size)
+    console.print(
+        f"[bold green]Trained dictionary {dict_id} on {samples_count} elements[/bold green]"
+    )
+
+
+@app.command()
+def convert_storage(
+    to: StorageMode = typer.Option(..., "--to", help="Target storage mode"),
+    batch_size: int = typer.Option(200, "--batch", "-b"),
+):
+    """Rewrite stored version content into another storage mode."""
+    from tools.zangov import storage
+    from tools.zangov.ingest_pg import init_db
+
+    init_db()
+    total = 0
+    for converted in storage.convert(to, batch_size=batch_size):
+        total += converted
+        console.print(f"converted {total} versions")
+    console.print(
+        f"[bold green]Converted {total} versions to {to.value}.[/bold green] "
+        "Run VACUUM FULL act_version to return the freed space to the disk."
+    )
+
+
+@app.command()
+def link_causes(
+    batch_size: int = typer.Option(
+        50_000, "--batch", "-b", help="Version ids per batch"
+    ),
+):
+    """Link act versions to their cause acts by cause_act_code."""
+    from tools.zangov import links
+    from tools.zangov.ingest_pg import init_db
+
+    init_db()
+    total = 0
+    for linked, last_id in links.link_causes(batch_size=batch_size):
+        total += linked
+        console.print(f"linked {total} versions, up to id {last_id}")
+    console.print(
+        f"[bold green]Linked {total} versions.[/bold green] "
+        f"{links.count_unresolved()} versions refer to acts that are not ingested."
+    )
+
+
+@app.command()
+def diff_versions(
+    batch_size: int = typer.Option(100, "--batch", "-b", help="Acts per transaction"),
+):
+    """Compute element changes between consecutive versions not diffed yet."""
+    from tools.zangov import diffs
+    from tools.zangov.ingest_pg import init_db
+
+    init_db()
+    total = found = 0
+    for diffed, changes in diffs.diff_versions(batch_size=batch_size):
+        total += diffed
+        found += changes
+        console.print(f"diffed {total} versions, {found} changes")
+    console.print(
+        f"[bold green]Diffed {total} versions, {found} element changes.[/bold green]"
+    )
+
+
+@app.command()
+def changes(
+    code: str = typer.Argument(..., help="Act code"),
+    language: Language = typer.Option(Language.RUS, "--language", "-l"),
+    since: datetime | None = typer.Option(
+        None, "--since", formats=["%Y-%m-%d"], help="Only versions from this date"
+    ),
+):
+    """Print the element changes of an act, version by version."""
+    from tools.zangov import diffs
+
+    for change in diffs.changes(code, language, since.date() if since else None):
+        line = f"{change.date} {change.kind.value:<8} #{change.position}"
+        if change.element_id:
+            line += f" [{change.element_id}]"
+        if change.cause_act_code:
+            line += f" by {change.cause_act_code}"
+        console.print(line, highlight=False)
+        text = change.new_text if change.new_text is not None else change.old_text
+        if text:
+            console.print(f"    {text}", highlight=False, markup=False)
+
+
+@app.command()
+def search_index(
+    batch_size: int = typer.Option(100, "--batch", "-b", help="Acts per transaction"),
+):
+    """Index the element texts of versions not indexed yet for search."""
+    from tools.zangov import search as search_
+    from tools.zangov.ingest_pg import init_db
+
+    init_db()
+    total = found = 0
+    for indexed, spans in search_.build_index(batch_size=batch_size):
+        total += indexed
+        found += spans
+        console.print(f"indexed {total} versions, {found} texts")
+    console.print(f"[bold green]Indexed {total} versions, {found} texts.[/bold green]")
+
+
+@app.command()
+def search(
+    query: str = typer.Argument(..., help='Words, "a phrase", or -excluded'),
+    language: Language = typer.Option(Language.RUS, "--language", "-l"),
+    actual: bool = typer.Option(False, "--actual", help="Actual versions only"),
+    as_of: datetime | None = typer.Option(
+        None, "--as-of", formats=["%Y-%m-%d"], help="Versions in force at this date"
+    ),
+    limit: int = typer.Option(20, "--limit", "-n"),
+    candidates: int | None = typer.Option(
+        None, "--candidates", help="Matches the hits are ranked among, 1000 by default"
+    ),
+):
+    """Search the text of act versions, run search-index first."""
+    from tools.zangov import search as search_
+
+    candidates = candidates or search_.CANDIDATES
+    hits, truncated = search_.search(
+        query,
+        language,
+        actual=actual,
+        as_of=as_of.date() if as_of else None,
+        limit=limit,
+        candidates=candidates,
+    )
+    for code, version_id, version_date, element_id, snippet in hits:
+        console.print(
+            f"[bold]{code}[/bold] {version_date} version {version_id}"
+            f" element {element_id}",
+            highlight=False,
+        )
+        console.print(f"    {snippet}", highlight=False, markup=False)
+    if not hits:
+        console.print("Nothing found.")
+    if truncated:
+        console.print(
+            f"[yellow]Ranked among the first {candidates} matches only, "
+            "narrow the query or raise --candidates.[/yellow]"
+        )
+
+
+@app.command()
+def as_of(
+    code: str = typer.Argument(..., help="Act code"),
+    day: datetime | None = typer.Option(
+        None, "--date", "-d", formats=["%Y-%m-%d"], help="Today by default"
+    ),
+    language: Language = typer.Option(Language.RUS, "--language", "-l"),
+    as_json: bool = typer.Option(False, "--json", help="Print the content elements"),
+):
+    """Print an act as it was on a date."""
+    import json
+
+    from tools.zangov import lookup
+
+    snapshot = lookup.as_of(code, language, day.date() if day else None)
+    if snapshot is None:
+        console.print(f"[bold red]No version of {code} by that date.[/bold red]")
+        raise typer.Exit(1)
+    if as_json:
+        typer.echo(json.dumps(snapshot.content, ensure_ascii=False, indent=2))
+    else:
+        typer.echo(snapshot.markdown)
+
+
+@app.command()
+def export_git(
+    repo: Path = typer.Argument(..., help="Git repository, created when missing"),
+    branch: str = typer.Option("main", "--branch", help="Branch to rebuild"),
+    batch_size: int = typer.Option(500, "--batch", "-b"),
+    processes: int | None = typer.Option(
+        None, "--processes", "-j", help="Rendering processes, all cores by default"
+    ),
+    render_cache: Path | None = typer.Option(
+        Path(".cache") / "markdown",
+        "--render-cache",
+        help="Cache of rendered Markdown by content hash",
+    ),
+    no_render_cache: bool = typer.Option(
+        False, "--no-render-cache", help="Render every version again"
+    ),
+    full: bool = typer.Option(
+        False, "--full", help="Rebuild the branch instead of adding the changes"
+    ),
+):
+    """Write the history of all act versions into a git repository, a commit per date."""
+    from tools.zangov import gitexport
+
+    commits = gitexport.export_git(
+        repo,
+        branch=branch,
+        batch_size=batch_size,
+        processes=processes,
+        cache_dir=None if no_render_cache else render_cache,
+        full=full,
+    )
+    console.print(
+        f"[bold green]Imported {commits} commits into {repo} ({branch}).[/bold green] "
+        f"Run git checkout -f {branch} there to update the working tree."
+    )
+
+
+@app.command()
+def export_md(
+    out: Path = typer.Argument(..., help="Directory of the Markdown tree"),
+    batch_size: int = typer.Option(500, "--batch", "-b"),
+    processes: int | None = typer.Option(
+        None, "--processes", "-j", help="Rendering processes, all cores by default"
+    ),
+    render_cache: Path | None = typer.Option(
+        Path(".cache") / "markdown",
+        "--render-cache",
+        help="Cache of rendered Markdown by content hash",
+    ),
+    no_render_cache: bool = typer.Option(
+        False, "--no-render-cache", help="Render every version again"
+    ),
+    full: bool = typer.Option(False, "--full", help="Write every version again"),
+):
+    """Write every act version as a Markdown file, updating only what changed."""
+    from tools.zangov import mdexport
+
+    written = removed = 0
+    for batch_written, batch_removed in mdexport.export_md(
+        out,
+        batch_size=batch_size,
+        processes=processes,
+        cache_dir=None if no_render_cache else render_cache,
+        full=full,
+    ):
+        written += batch_written
+        removed += batch_removed
+        console.print(f"written {written} files, removed {removed}")
+    console.print(
+        f"[bold green]Exported to {out}: {written} files written, "
+        f"{removed} removed.[/bold green]"
+    )
+
+
+@app.command()
+def mock_server(
+    port: int = typer.Option(8765, "--port"),
+    acts: int = typer.Option(100, "--acts", help="Acts in the listing"),
+    versions: int = typer.Option(5, "--versions", help="Versions of synthetic acts"),
+    pages: int = typer.Option(2, "--pages", help="Pages of a synthetic version"),
+    elements: int = typer.Option(200, "--elements", help="Elements on a page"),
+    latency: float = typer.Option(0.0, "--latency", help="Seconds per response"),
+    error_rate: float = typer.Option(
+        0.0, "--error-rate", help="Share of responses failing with 503"
+    ),
+):
+    """Serve a local stand-in of the zan.gov.kz API, for ingest --api-url."""
+    from tools.zangov.mockserver import Corpus, MockServer
+
+    corpus = Corpus(acts=acts, versions=versions, pages=pages, elements=elements)
+    server = MockServer(corpus, port=port, latency=latency, error_rate=error_rate)
+    console.print(f"Serving {len(corpus.codes)} acts at [bold]{server.url}[/bold]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@app.command()
+def bench(
+    workers: list[int] = typer.Option(
+        [1, 2, 4, 8], "--workers", "-w", help="Worker counts to run, repeatable"
+    ),
+    fan_out: int = typer.Option(8, "--fan-out", "-f"),
+    acts: int = typer.Option(100, "--acts", help="Acts in the listing"),
+    versions: int = typer.Option(5, "--versions", help="Versions of synthetic acts"),
+    pages: int = typer.Option(2, "--pages", help="Pages of a synthetic version"),
+    elements: int = typer.Option(200, "--elements", help="Elements on a page"),
+    latency: float = typer.Option(0.02, "--latency", help="Seconds per response"),
+    error_rate: float = typer.Option(
+        0.0, "--error-rate", help="Share of responses failing with 503"
+    ),
+    storage_mode: StorageMode = typer.Option(StorageMode.TEXT, "--storage"),
+    yes: bool = typer.Option(False, "--yes", "-y", help="Do not ask to drop tables"),
+):
+    """Benchmark ingest against the mock server at several worker counts."""
+    from rich.table import Table
+
+    from tools.zangov import bench as bench_
+
+    if not yes:
+        typer.confirm(
+            "Every run drops all tables of the database, continue?", abort=True
+        )
+
+    table = Table(
+        "workers",
+        "acts/s",
+        "requests/s",
+        "MB/s",
+        "errors",
+        "peak RSS, MB",
+        "DB write, s",
+        "elapsed, s",
+    )
+    runs = bench_.bench(
+        workers,
+        corpus_options=dict(
+            acts=acts, versions=versions, pages=pages, elements=elements
+        ),
+        latency=latency,
+        error_rate=error_rate,
+        fan_out=fan_out,
+        storage_mode=storage_mode,
+    )
+    for r in runs:
+        console.print(
+            f"{r['workers']} workers: {r['acts']} acts, {r['versions']} versions "
+            f"in {r['elapsed']:.1f}s"
+        )
+        table.add_row(
+            str(r["workers"]),
+            f"{r['acts_per_s']:.1f}",
+            f"{r['requests_per_s']:.0f}",
+            f"{r['bytes_per_s'] / 1024**2:.1f}",
+            str(r["errors"]),
+            f"{r['peak_rss'] / 1024**2:.0f}",
+            f"{r['db_write']:.1f}",
+            f"{r['elapsed']:.1f}",
+        )
+    console.print(table)
+
+
 @app.callback(invoke_without_command=True)
-def main(ctx: typer.Context):
+def main(
+    ctx: typer.Context,
+    dsn: str | None = typer.Option(
+        None,
+        "--dsn",
+        help="Database URL, postgresql+psycopg://..., or set QAZ_LAW_DSN",
+    ),
+):
+    if dsn:
+        from tools.zangov import models
+
+        models.configure(url=dsn)
     if ctx.invoked_subcommand is None:
         console.print(ctx.get_help())
 
@@ -0,0 +1,42 @@
+from tools.zangov.diffs import diff_contents
+from tools.zangov.enums import DiffKind
+
+BLANK = {"type": "paragraph", "level": 2, "text": ""}
+ARTICLE = {"id": "a1", "type": "article", "level": 1, "text": "Article 1."}
+
+
+def changes(old: list[dict], new: list[dict]) -> list[tuple[DiffKind, int]]:
+    return [(kind, position) for kind, position, _, _ in diff_contents(old, new)]
+
+
+def test_unchanged_repeated_elements():
+    content = [ARTICLE, BLANK, BLANK]
+    assert changes(content, content) == []
+
+
+def test_repeated_element_added():
+    assert changes([ARTICLE, BLANK], [ARTICLE, BLANK, BLANK]) == [(DiffKind.ADDED, 2)]
+
+
+def test_repeated_element_removed():
+    assert changes([BLANK, ARTICLE, BLANK], [ARTICLE, BLANK]) == [(DiffKind.REMOVED, 2)]
+
+
+def test_element_with_id_modified():
+    modified = {**ARTICLE, "text": "Article 1, amended."}
+    assert list(diff_contents([ARTICLE, BLANK], [modified, BLANK])) == [
+        (DiffKind.MODIFIED, 0, ARTICLE, modified)
+    ]
+
+
+def test_repeated_id_modified():
+    second = {**ARTICLE, "text": "Article 2."}
+    modified = {**ARTICLE, "text": "Article 1, amended."}
+    assert list(diff_contents([ARTICLE, second], [modified, second])) == [
+        (DiffKind.MODIFIED, 0, ARTICLE, modified)
+    ]
+
+
+def test_repeated_id_added():
+    second = {**ARTICLE, "text": "Article 2."}
+    assert changes([ARTICLE], [ARTICLE, second]) == [(DiffKind.ADDED, 1)]
@@ -0,0 +1,155 @@
+"""Asyncio API client for Zan.gov.kz legislative documents API.
+
+Mirrors the blocking functions of `client` as coroutines. All requests of the
+process share one `httpx.AsyncClient` and one global concurrency limit, so
+hundreds of requests can be kept in flight without running an OS thread each.
+"""
+
+import asyncio
+import logging
+from datetime import date
+from typing import AsyncIterator, Literal
+
+import httpx
+from httpx_retries import RetryTransport
+
+from . import client, metrics
+from .cache import CachingTransport
+from .client import (
+    default_headers,
+    document_params,
+    document_url,
+    parse_document,
+    parse_search_page,
+    parse_versions,
+    search_payload,
+    versions_url,
+)
+from .enums import ActTypeEnum
+from .ratelimit import RateLimitedTransport
+from .schemas import Document, SearchActMetadata, SearchPage, VersionInfo
+
+logger = logging.getLogger(__name__)
+
+
+# max number of requests in flight for the whole process
+DEFAULT_CONCURRENCY = 200
+
+_concurrency = DEFAULT_CONCURRENCY
+_client: httpx.AsyncClient | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+def configure(concurrency: int = DEFAULT_CONCURRENCY):
+    """Set the global concurrency limit, must be called before the first request."""
+    global _concurrency
+    if _client is not None:
+        raise RuntimeError("async client is already started")
+    _concurrency = concurrency
+
+
+def get_client() -> httpx.AsyncClient:
+    # the client and the semaphore are bound to the running event loop,
+    # so they are created on the first request instead of at import
+    global _client, _semaphore
+    if _client is None:
+        transport = RetryTransport(
+            transport=RateLimitedTransport(
+                client.limiter,
+                metrics.InstrumentedTransport(
+                    httpx.AsyncHTTPTransport(
+                        verify=False,
+                        limits=httpx.Limits(
+                            max_connections=_concurrency,
+                            max_keepalive_connections=_concurrency,
+                        ),
+                    )
+                ),
+            )
+        )
+        # share the response cache configured for the blocking client
+        if client.response_cache is not None:
+            transport = CachingTransport(
+                client.response_cache, transport, replay=client.replay
+            )
+        _client = httpx.AsyncClient(
+            base_url=client.base_url,
+            headers=default_headers(),
+            transport=transport,
+            timeout=60,  # huge docs take a long time to download
+        )
+        _semaphore = asyncio.Semaphore(_concurrency)
+    return _client
+
+
+async def aclose():
+    global _client, _semaphore
+    if _client is not None:
+        await _client.aclose()
+    _client = _semaphore = None
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    http = get_client()
+    async with _semaphore:
+        return await http.request(method, url, **kwargs)
+
+
+async def list_documents(
+    page: int = 1, per_page: int = 20, act_types: list[ActTypeEnum] | None = None
+) -> SearchPage:
+    url = "/documents/search"
+    json_payload = search_payload(page, per_page, act_types)
+    response = await _request("POST", url, json=json_payload)
+    return parse_search_page(response)
+
+
+async def iterate_documents(
+    start_page: int = 1, prefetch: int = 4, **kwargs
+) -> AsyncIterator[tuple[int, SearchActMetadata]]:
+    """Walk the search listing, with up to `prefetch` pages requested ahead."""
+    prefetch = max(prefetch, 1)  # the next page is always requested
+    search_page = await list_documents(start_page, **kwargs)
+    end_page = search_page.page_count
+    pending: dict[int, asyncio.Task] = {}
+    next_page = start_page + 1
+    page = start_page
+    try:
+        while True:
+            while len(pending) < prefetch and next_page <= end_page:
+                pending[next_page] = asyncio.create_task(
+                    list_documents(next_page, **kwargs)
+                )
+                next_page += 1
+
+            print("page", page, "of", end_page)
+            for doc in search_page.documents:
+                yield page, doc
+
+            page += 1
+            if page not in pending:
+                break
+            search_page = await pending.pop(page)
+    finally:
+        for task in pending.values():
+            task.cancel()
+
+
+async def get_document(
+    document_id: str,
+    language: Literal["rus", "kaz"] | str,
+    version: date | None = None,
+    html: bool = False,
+    page: int = 1,
+) -> Document:
+    """Get a document by ID and language."""
+    url = document_url(document_id, language, version)
+    params = document_params(html, page)
+    response = await _request("GET", url, params=params)
+    return parse_document(response)
+
+
+async def get_document_versions(document_id: str, language: str) -> list[VersionInfo]:
+    url = versions_url(document_id, language)
+    response = await _request("GET", url)
+    return parse_versions(response)
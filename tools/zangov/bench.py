@@ -0,0 +1,172 @@
+"""End-to-end ingest benchmark against the local `mockserver`.
+
+The mock server runs in its own process for the whole benchmark. Every run
+ingests its corpus into an empty database in a fresh process, so the peak RSS
+is the run's own and nothing is warmed up by an earlier run.
+
+The database tables are dropped before every run, point it to a scratch
+database.
+"""
+
+import json
+import multiprocessing
+import re
+import resource
+import time
+import urllib.request
+
+from .enums import StorageMode
+
+# statements writing acts and their versions through the ORM, the schema setup
+# and the frontier bookkeeping are not part of the write cost
+ACT_WRITE = re.compile(
+    r"\s*(INSERT\s+INTO|UPDATE)\s+(act|act_version|act_type_link)\b", re.IGNORECASE
+)
+
+
+def _serve(corpus_options: dict, latency: float, error_rate: float, ready):
+    from .mockserver import Corpus, MockServer
+
+    server = MockServer(
+        Corpus(**corpus_options), latency=latency, error_rate=error_rate
+    )
+    ready.put(server.url)
+    server.serve_forever()
+
+
+def _ingest(
+    api_url: str,
+    workers: int,
+    fan_out: int,
+    storage_mode: StorageMode,
+    max_rate: float,
+    database_url: str,
+    results,
+):
+    from sqlalchemy import event
+    from sqlmodel import Session, func, select
+
+    from . import client, metrics, models, storage
+    from .ingest_pg import EXTRA_CONNECTIONS, ingest_all
+    from .models import Act, ActVersion, get_engine
+
+    # sized here, resizing in ingest_all would drop the listeners below
+    models.configure(url=database_url, size=workers + EXTRA_CONNECTIONS)
+    client.configure(api_url=api_url)
+    client.limiter.max_rate = max_rate
+    storage.configure(storage_mode)
+
+    # act writes through the ORM, COPY of versions is timed as the flush stage
+    statement_seconds = 0.0
+
+    engine = get_engine()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info["started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        nonlocal statement_seconds
+        started = conn.info.pop("started")
+        if ACT_WRITE.match(statement):
+            statement_seconds += time.perf_counter() - started
+
+    started = time.perf_counter()
+    ingest_all(recreate=True, max_workers=workers, fan_out=fan_out)
+    elapsed = time.perf_counter() - started
+
+    flush = metrics.registry.histogram("stage_seconds", stage="flush")
+    with Session(engine) as s:
+        acts = s.exec(select(func.count()).select_from(Act)).one()
+        versions = s.exec(select(func.count()).select_from(ActVersion)).one()
+    results.put(
+        {
+            "elapsed": elapsed,
+            "acts": acts,
+            "versions": versions,
+            # kilobytes on Linux
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "db_write": statement_seconds + (flush.sum if flush else 0.0),
+        }
+    )
+
+
+def server_stats(api_url: str) -> dict:
+    stats_url = api_url.removesuffix("/api") + "/_stats"
+    with urllib.request.urlopen(stats_url) as response:
+        return json.load(response)
+
+
+def run(
+    api_url: str,
+    workers: int,
+    fan_out: int = 8,
+    storage_mode: StorageMode = StorageMode.TEXT,
+    max_rate: float = 10_000,
+) -> dict:
+    """Ingest the whole mock corpus with `workers` workers, return the measures."""
+    from . import models
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    before = server_stats(api_url)
+    proc = ctx.Process(
+        target=_ingest,
+        args=(
+            api_url,
+            workers,
+            fan_out,
+            storage_mode,
+            max_rate,
+            models.database_url,
+            results,
+        ),
+    )
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError(f"ingest run failed with code {proc.exitcode}")
+    result = results.get()
+    after = server_stats(api_url)
+
+    elapsed = result["elapsed"]
+    requests = after["requests"] - before["requests"]
+    return {
+        "workers": workers,
+        **result,
+        "requests": requests,
+        "errors": after["errors"] - before["errors"],
+        "acts_per_s": result["acts"] / elapsed,
+        "requests_per_s": requests / elapsed,
+        "bytes_per_s": (after["bytes"] - before["bytes"]) / elapsed,
+    }
+
+
+def bench(
+    worker_counts: list[int],
+    corpus_options: dict | None = None,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    **run_options,
+):
+    """
+    Start the mock server and run the ingest for every worker count.
+
+    Yields the measures of every run, see `run` for `run_options`.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    server = ctx.Process(
+        target=_serve,
+        args=(corpus_options or {}, latency, error_rate, ready),
+        daemon=True,
+    )
+    server.start()
+    try:
+        api_url = ready.get(timeout=30)
+        for workers in worker_counts:
+            yield run(api_url, workers, **run_options)
+    finally:
+        server.terminate()
+        server.join()
@@ -0,0 +1,51 @@
+"""In-flight byte budget shared between ingest workers.
+
+Workers reserve bytes for responses before requesting them and release them once
+the content is written, so the memory taken by documents in flight stays under a
+limit whatever their size. Pages are counted by their response size, which is
+less than what the parsed documents take, so the limit is not the peak memory.
+"""
+
+import threading
+
+DEFAULT_LIMIT = 512 * 1024**2
+
+
+class ByteBudget:
+    """
+    Count of bytes held by workers, with blocking reservations over a limit.
+
+    A reservation larger than the whole limit is granted when nothing else is
+    held, so a single huge document still makes progress.
+    """
+
+    def __init__(self, limit: int = DEFAULT_LIMIT):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def _fits(self, n: int) -> bool:
+        return self.used == 0 or self.used + n <= self.limit
+
+    def acquire(self, n: int):
+        """Block until `n` bytes fit into the budget and take them."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._fits(n))
+            self.used += n
+
+    def try_acquire(self, n: int) -> bool:
+        with self._cond:
+            if not self._fits(n):
+                return False
+            self.used += n
+            return True
+
+    def charge(self, n: int):
+        """Take `n` bytes without waiting, for memory that is already held."""
+        with self._cond:
+            self.used += n
+
+    def release(self, n: int):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
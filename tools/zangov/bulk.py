@@ -0,0 +1,124 @@
+"""Bulk writes of act versions with psycopg COPY.
+
+Versions are streamed into a temporary staging table and moved into `act_version`
+with a single statement, inside the transaction of the ORM session. Rows that
+already exist by `uc_act_version_act_id_date_language` are skipped, not failed.
+
+The staging table is created once per connection. `VersionWriter` collects the
+rows of an act and copies them in batches, so a version streamed on its own does
+not cost a COPY of its own.
+"""
+
+from typing import Iterable
+
+import sqlalchemy as sa
+from sqlmodel import Session
+
+from . import metrics
+from .enums import Language
+
+# values of an act version row, as built by `ingest_pg.write_versions`
+VERSION_COLUMNS = (
+    "act_id",
+    "cause_act_code",
+    "date",
+    "language",
+    "is_actual",
+    "version_id",
+    "content",
+    "element_hashes",
+    "content_zst",
+    "content_hash",
+    "pages_count",
+)
+
+_COLUMNS = ", ".join(VERSION_COLUMNS)
+
+CREATE_STAGE = f"""
+CREATE TEMP TABLE IF NOT EXISTS act_version_stage ON COMMIT DELETE ROWS
+AS SELECT {_COLUMNS} FROM act_version WITH NO DATA
+"""
+
+# empties the stage too, for the next batch of the same transaction
+MOVE_STAGE = f"""
+WITH staged AS (DELETE FROM act_version_stage RETURNING {_COLUMNS})
+INSERT INTO act_version ({_COLUMNS})
+SELECT {_COLUMNS} FROM staged
+ON CONFLICT ON CONSTRAINT uc_act_version_act_id_date_language DO NOTHING
+"""
+
+# rows and encoded bytes a `VersionWriter` collects before it copies them
+BATCH_ROWS = 100
+BATCH_BYTES = 16 * 1024**2
+
+# key in the pool's info of a connection, whose staging table exists
+_STAGED = "act_version_stage"
+
+
+@sa.event.listens_for(sa.Engine, "rollback")
+def _forget_stage(conn: sa.Connection):
+    # a rolled back transaction may have created the table, check it again
+    conn.connection.info.pop(_STAGED, None)
+
+
+def _copy_value(column: str, value):
+    if column == "language":
+        # sa.Enum(native_enum=False) stores enum names
+        return Language(value).name
+    return value
+
+
+def copy_act_versions(s: Session, rows: Iterable[dict]) -> int:
+    """
+    Write act versions with COPY in the session transaction, return the inserted count.
+
+    The act rows must be flushed already.
+    """
+    s.flush()
+    # building a row may query the database, which is not possible while COPY runs
+    rows = list(rows)
+    if not rows:
+        return 0
+    pooled = s.connection().connection
+    raw = pooled.driver_connection  # psycopg connection
+
+    with metrics.stage("flush"), raw.cursor() as cur:
+        if _STAGED not in pooled.info:
+            cur.execute(CREATE_STAGE)
+            pooled.info[_STAGED] = True
+        with cur.copy(f"COPY act_version_stage ({_COLUMNS}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row([_copy_value(c, row.get(c)) for c in VERSION_COLUMNS])
+        cur.execute(MOVE_STAGE)
+        return cur.rowcount
+
+
+class VersionWriter:
+    """
+    Act version rows collected in a session and copied in batches.
+
+    A batch is copied once it has `max_rows` rows or `max_bytes` bytes, and by
+    `flush`, which must be called before the transaction is committed.
+    """
+
+    def __init__(
+        self, s: Session, max_rows: int = BATCH_ROWS, max_bytes: int = BATCH_BYTES
+    ):
+        self.s = s
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows: list[dict] = []
+        self.size = 0  # bytes of the collected rows
+        self.inserted = 0
+
+    def add(self, row: dict, size: int = 0):
+        self.rows.append(row)
+        self.size += size
+        if len(self.rows) >= self.max_rows or self.size >= self.max_bytes:
+            self.flush()
+
+    def flush(self) -> int:
+        """Copy the collected rows, return the number inserted so far."""
+        rows, self.rows, self.size = self.rows, [], 0
+        self.inserted += copy_act_versions(self.s, rows)
+        return self.inserted
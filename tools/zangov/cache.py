@@ -0,0 +1,202 @@
+"""Content-addressed on-disk cache of zan.gov.kz API responses.
+
+Raw response bodies are stored zstd-compressed, one file per request, keyed by
+a hash of the method, host, port, path, query parameters and body, so responses
+of the mock server never mix with real ones. The `r` cache-buster parameter is
+ignored, so the same request made on different days hits the same entry. Least
+recently used entries are evicted when the size cap is hit.
+
+Only documents requested by version date are served from the cache while
+crawling, since the latest documents, version listings and search pages change
+upstream. Every response is still stored, so a crawl can be replayed in full.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from compression import zstd
+from pathlib import Path
+
+import httpx
+
+DEFAULT_CACHE_DIR = Path(".cache") / "zangov"
+DEFAULT_MAX_BYTES = 20 * 1024**3
+
+# responses worth caching, 404 means a missing language version and is stable
+CACHED_STATUSES = (200, 404)
+
+IGNORED_PARAMS = ("r",)
+
+# /documents/{id}/{lang}/{dd.mm.yyyy}, a fixed version of a document never changes
+IMMUTABLE_PATH = re.compile(r"/documents/[^/]+/[^/]+/\d{2}\.\d{2}\.\d{4}$")
+
+
+class CacheMissError(httpx.TransportError):
+    """A request is missing from the cache in replay mode."""
+
+
+class ResponseCache:
+    """Size-capped LRU cache of response bodies, safe to share between threads."""
+
+    def __init__(
+        self,
+        root: str | Path = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        level: int = 3,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.level = level
+        self.hits = self.misses = 0
+
+        self._lock = threading.Lock()
+        self._sizes: OrderedDict[str, int] = OrderedDict()  # oldest first
+        self._total = 0
+        self._load()
+
+    def _load(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".zst"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._total += size
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def size(self) -> int:
+        return self._total
+
+    @staticmethod
+    def key(request: httpx.Request) -> str:
+        params = sorted(
+            (k, v)
+            for k, v in request.url.params.multi_items()
+            if k not in IGNORED_PARAMS
+        )
+        h = hashlib.sha256()
+        h.update(request.method.encode())
+        h.update(b"\0")
+        h.update(f"{request.url.host}:{request.url.port or ''}".encode())
+        h.update(b"\0")
+        h.update(request.url.path.encode())
+        h.update(b"\0")
+        h.update(repr(params).encode())
+        h.update(b"\0")
+        h.update(request.content)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.zst"
+
+    def get(self, key: str) -> tuple[int, bytes] | None:
+        path = self._path(key)
+        try:
+            data = zstd.decompress(path.read_bytes())
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        os.utime(path)  # keep the LRU order across runs
+        status, _, content = data.partition(b"\n")
+        return int(status), content
+
+    def put(self, key: str, status: int, content: bytes):
+        data = zstd.compress(b"%d\n" % status + content, level=self.level)
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)  # atomic, readers never see a partial entry
+
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            evicted = self._evict()
+        for old_key in evicted:
+            self._path(old_key).unlink(missing_ok=True)
+
+    def _evict(self) -> list[str]:
+        evicted = []
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            old_key, size = self._sizes.popitem(last=False)
+            self._total -= size
+            evicted.append(old_key)
+        return evicted
+
+
+class CachingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Serve responses from a `ResponseCache` and store the fetched ones.
+
+    With `replay` nothing reaches the network: every request is served
+    from the cache or fails with `CacheMissError`.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        transport: httpx.BaseTransport | httpx.AsyncBaseTransport | None = None,
+        replay: bool = False,
+    ):
+        self.cache = cache
+        self.transport = transport
+        self.replay = replay
+
+    def _lookup(self, request: httpx.Request) -> tuple[str, httpx.Response | None]:
+        key = self.cache.key(request)
+        if self.replay or IMMUTABLE_PATH.search(request.url.path):
+            cached = self.cache.get(key)
+            if cached:
+                status, content = cached
+                return key, httpx.Response(status, content=content, request=request)
+        if self.replay:
+            raise CacheMissError(f"not cached: {request.url}", request=request)
+        return key, None
+
+    def _store(self, key: str, response: httpx.Response) -> httpx.Response:
+        # the response is read already, the client gets the decoded content as is
+        if response.status_code in CACHED_STATUSES:
+            self.cache.put(key, response.status_code, response.content)
+        return response
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key, response = self._lookup(request)
+        if response is not None:
+            return response
+        response = self.transport.handle_request(request)
+        response.read()
+        response.close()
+        return self._store(key, response)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key, response = self._lookup(request)
+        if response is not None:
+            return response
+        response = await self.transport.handle_async_request(request)
+        await response.aread()
+        await response.aclose()
+        return self._store(key, response)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
@@ -1,19 +1,29 @@
 """Main API client for Zan.gov.kz legislative documents API."""
 
 import logging
+import threading
 import time
 from datetime import date
 from pathlib import Path
-from time import sleep
 from typing import Iterable, Literal
 
 import httpx
-from fake_useragent import UserAgent
 from httpx_retries import RetryTransport
+from pydantic import TypeAdapter
 
+from . import metrics
+from .cache import CachingTransport, ResponseCache
 from .enums import ActTypeEnum
 from .md import document_to_md
-from .schemas import Document, SearchActMetadata, SearchPage, VersionInfo
+from .ratelimit import AdaptiveLimiter, RateLimitedTransport
+from .schemas import (
+    Document,
+    FullDocument,
+    FullVersionInfo,
+    SearchActMetadata,
+    SearchPage,
+    VersionInfo,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -25,32 +35,101 @@ DEFAULT_RETRY_DELAY = 1.0
 # Base URL
 BASE_URL = "https://zan.gov.kz/api"
 
-# HTTP Headers
-ua = UserAgent()
+# HTTP Headers, with a User-Agent picked by `default_headers`
 DEFAULT_HEADERS = {
     "Accept": "*/*",
     "X-Requested-With": "XMLHttpRequest",
     "Referer": "https://zan.gov.kz/client/",
-    "User-Agent": ua.random,
     "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
     "Sec-Fetch-Dest": "empty",
     "Sec-Fetch-Mode": "cors",
     "Sec-Fetch-Site": "same-origin",
 }
 
+_user_agent: str | None = None
 
-httpx_client = httpx.Client(
-    base_url=BASE_URL,
-    headers=DEFAULT_HEADERS.copy(),
-    transport=RetryTransport(transport=httpx.HTTPTransport(verify=False)),
-    timeout=60,  # huge docs take a long time to download
-)
 
+def default_headers() -> dict:
+    """`DEFAULT_HEADERS` with a random browser User-Agent, the same for the process."""
+    global _user_agent
+    if _user_agent is None:
+        # loads its browser database, only worth it when requests are made
+        from fake_useragent import UserAgent
 
-def list_documents(
+        _user_agent = UserAgent().random
+    return {**DEFAULT_HEADERS, "User-Agent": _user_agent}
+
+
+# API to talk to, the real one or a stand-in like `mockserver`, see `configure`
+base_url = BASE_URL
+
+# on-disk response cache, see `configure`
+response_cache: ResponseCache | None = None
+replay = False
+
+# validate responses against the full API schema, forbidding unknown fields,
+# instead of parsing only the fields we persist
+strict = False
+
+# paces every request of the process, sync and async, retries included
+limiter = AdaptiveLimiter()
+
+# the blocking client, created on the first request, see `get_client`
+_client: httpx.Client | None = None
+_client_lock = threading.Lock()
+
+
+def make_client() -> httpx.Client:
+    transport = RetryTransport(
+        transport=RateLimitedTransport(
+            limiter, metrics.InstrumentedTransport(httpx.HTTPTransport(verify=False))
+        )
+    )
+    if response_cache is not None:
+        transport = CachingTransport(response_cache, transport, replay=replay)
+    return httpx.Client(
+        base_url=base_url,
+        headers=default_headers(),
+        transport=transport,
+        timeout=60,  # huge docs take a long time to download
+    )
+
+
+def get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = make_client()
+    return _client
+
+
+def configure(
+    cache: ResponseCache | None = None,
+    replay_only: bool = False,
+    api_url: str | None = None,
+):
+    """
+    Put a response cache in front of the API, for this and the async client.
+
+    With `replay_only` every request is served from the cache and never hits the server.
+    `api_url` replaces the base URL of the API.
+    """
+    global _client, response_cache, replay, base_url
+    if replay_only and cache is None:
+        raise ValueError("replay needs a response cache")
+    response_cache, replay = cache, replay_only
+    if api_url is not None:
+        base_url = api_url
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None  # made again with the new settings on first use
+
+
+def search_payload(
     page: int = 1, per_page: int = 20, act_types: list[ActTypeEnum] | None = None
-) -> SearchPage:
-    url = f"/documents/search"
+) -> dict:
     json_payload = {
         "page": page,
         "limit": per_page,
@@ -58,10 +137,71 @@ def list_documents(
     }
     if act_types:
         json_payload["actTypes"] = [v.value for v in act_types]
+    return json_payload
+
+
+def document_url(document_id: str, language: str, version: date | None = None) -> str:
+    url = f"/documents/{document_id}/{language}"
+    if version:
+        url += f"/{version.strftime('%d.%m.%Y')}"
+    return url
+
+
+def document_params(html: bool = False, page: int = 1) -> dict:
+    return {
+        "withHtml": "true" if html else "false",
+        "page": page,
+        "r": int(time.time() * 1000),
+    }
+
+
+def versions_url(document_id: str, language: str) -> str:
+    return f"/documents/{document_id}/{language}/versions"
+
 
-    response = httpx_client.post(url, json=json_payload)
+versions_adapter = TypeAdapter(list[VersionInfo])
+full_versions_adapter = TypeAdapter(list[FullVersionInfo])
+
+
+def parse_search_page(response: httpx.Response) -> SearchPage:
     response.raise_for_status()
-    return SearchPage.model_validate(response.json(), extra="forbid")
+    with metrics.stage("validate"):
+        if strict:
+            return SearchPage.model_validate(response.json(), extra="forbid")
+        return SearchPage.model_validate_json(response.content)
+
+
+def parse_document(response: httpx.Response) -> Document:
+    """
+    Parse a document from the raw response body in a single pass.
+
+    Fields we don't persist, like the base64 signature container, are skipped by
+    the JSON parser. With `strict` the full schema is validated instead.
+    """
+    response.raise_for_status()
+    with metrics.stage("validate"):
+        if strict:
+            return FullDocument.model_validate(response.json(), extra="forbid")
+        return Document.model_validate_json(response.content)
+
+
+def parse_versions(response: httpx.Response) -> list[VersionInfo]:
+    response.raise_for_status()
+    with metrics.stage("validate"):
+        if strict:
+            return full_versions_adapter.validate_python(
+                response.json(), extra="forbid"
+            )
+        return versions_adapter.validate_json(response.content)
+
+
+def list_documents(
+    page: int = 1, per_page: int = 20, act_types: list[ActTypeEnum] | None = None
+) -> SearchPage:
+    url = f"/documents/search"
+    json_payload = search_payload(page, per_page, act_types)
+    response = get_client().post(url, json=json_payload)
+    return parse_search_page(response)
 
 
 def iterate_documents(
@@ -75,7 +215,6 @@ def iterate_documents(
         for doc in search_page.documents:
             yield page, doc
         page += 1
-        sleep(0.1)
 
 
 def get_document(
@@ -86,28 +225,25 @@ def get_document(
     page: int = 1,
 ) -> Document:
     """Get a document by ID and language."""
-    url = f"/documents/{document_id}/{language}"
-    if version:
-        url += f"/{version.strftime('%d.%m.%Y')}"
+    url = document_url(document_id, language, version)
+    params = document_params(html, page)
+    response = get_client().get(url, params=params)
+    return parse_document(response)
 
-    params = {
-        "withHtml": "true" if html else "false",
-        "page": page,
-        "r": int(time.time() * 1000),
-    }
 
-    response = httpx_client.get(url, params=params)
-    response.raise_for_status()
-    return Document.model_validate(response.json(), extra="forbid")
+def get_document_page(
+    document_id: str, language: str, version: date | None = None, page: int = 1
+) -> tuple[Document, int]:
+    """`get_document` that also tells the size of the response body."""
+    url = document_url(document_id, language, version)
+    response = get_client().get(url, params=document_params(page=page))
+    return parse_document(response), len(response.content)
 
 
 def get_document_versions(document_id: str, language: str):
-    url = f"/documents/{document_id}/{language}/versions"
-    response = httpx_client.get(url)
-    response.raise_for_status()
-    return [
-        VersionInfo.model_validate(item, extra="forbid") for item in response.json()
-    ]
+    url = versions_url(document_id, language)
+    response = get_client().get(url)
+    return parse_versions(response)
 
 
 def dump(d: Document) -> Path:
@@ -125,3 +261,10 @@ def dump(d: Document) -> Path:
         else:
             f.write(document_to_md(d))
     return path
+
+
+def __getattr__(name: str):
+    # `client.httpx_client` still works, it is created when first asked for
+    if name == "httpx_client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
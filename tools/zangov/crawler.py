@@ -0,0 +1,121 @@
+"""Prefetching crawler over the `/documents/search` listing."""
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
+from .client import list_documents
+from .enums import ActTypeEnum
+from .schemas import SearchActMetadata
+
+# search pages requested ahead of the consumer
+DEFAULT_PREFETCH = 4
+# listed documents waiting for a worker
+DEFAULT_QUEUE_SIZE = 1000
+
+_DONE = object()
+
+
+class SearchCrawler:
+    """
+    Walk the search listing in a background thread and feed a bounded queue.
+
+    The first page tells the page count, then up to `prefetch` following pages
+    are requested at once. Documents are queued in the listing order, a full
+    queue stops the crawler until the workers catch up.
+
+        crawler = SearchCrawler(start_page, per_page=100)
+        for page, doc_meta in crawler:
+            ...
+    """
+
+    def __init__(
+        self,
+        start_page: int = 1,
+        per_page: int = 100,
+        act_types: list[ActTypeEnum] | None = None,
+        prefetch: int = DEFAULT_PREFETCH,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        self.start_page = start_page
+        self.per_page = per_page
+        self.act_types = act_types
+        self.prefetch = max(prefetch, 1)
+        self.page_count: int | None = None
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __iter__(self) -> Iterator[tuple[int, SearchActMetadata]]:
+        self.start()
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="crawler", daemon=True
+            )
+            self._thread.start()
+
+    def close(self):
+        """Stop the crawler, documents already queued are dropped."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _put(self, item) -> bool:
+        # block on a full queue, but wake up regularly to check for close()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _list(self, page: int):
+        return list_documents(page, per_page=self.per_page, act_types=self.act_types)
+
+    def _run(self):
+        # sliding window of pages requested ahead
+        pending: dict[int, Future] = {}
+        executor = ThreadPoolExecutor(
+            max_workers=self.prefetch, thread_name_prefix="crawler"
+        )
+        try:
+            page = self.start_page
+            search_page = self._list(page)
+            self.page_count = search_page.page_count
+            next_page = page + 1
+            while True:
+                while len(pending) < self.prefetch and next_page <= self.page_count:
+                    pending[next_page] = executor.submit(self._list, next_page)
+                    next_page += 1
+
+                print("page", page, "of", self.page_count)
+                for doc in search_page.documents:
+                    if not self._put((page, doc)):
+                        return  # closed
+
+                page += 1
+                if page not in pending:
+                    break
+                search_page = pending.pop(page).result()
+        except BaseException as e:
+            self._put(e)
+        else:
+            self._put(_DONE)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+"""Element level diffs between consecutive versions of an act in a language.
+
+Content elements keep their `id` between versions, so two contents are compared
+by element id: an element is added, removed, or modified when its canonical
+JSON differs. Elements without an id are matched by their whole content. Both
+are also matched by which occurrence of that id or content they are, so a
+repeated id or duplicate content does not hide a change. The
+changes are stored in `act_version_diff` with the cause act of the version, so
+"what changed in this version" is an index lookup.
+
+`diff_versions` is a batch job over the versions not diffed yet. A version that
+appears between two diffed ones also gets its successor diffed again.
+"""
+
+from collections import Counter
+from datetime import date
+from typing import Iterator
+
+from sqlalchemy import delete, insert, update
+from sqlmodel import Session, select
+
+from . import storage
+from .enums import DiffKind, Language
+from .models import Act, ActVersion, ActVersionDiff, get_engine
+
+
+def _keyed(content: list[dict]) -> dict[tuple[str, int], tuple[int, dict, str]]:
+    """Elements by id and occurrence, with their position and canonical JSON."""
+    elements = {}
+    repeats: Counter[str] = Counter()
+    for position, el in enumerate(content):
+        data = storage.element_json(el)
+        key = el.get("id") or f"#{storage.element_hash(data).hex()}"
+        elements[key, repeats[key]] = position, el, data
+        repeats[key] += 1
+    return elements
+
+
+def diff_contents(
+    old: list[dict], new: list[dict]
+) -> Iterator[tuple[DiffKind, int, dict | None, dict | None]]:
+    """Changes from `old` to `new` as (kind, position, old element, new element)."""
+    old_elements = _keyed(old)
+    new_elements = _keyed(new)
+    for key, (position, el, data) in new_elements.items():
+        previous = old_elements.get(key)
+        if previous is None:
+            yield DiffKind.ADDED, position, None, el
+        elif previous[2] != data:
+            yield DiffKind.MODIFIED, position, previous[1], el
+    for key, (position, el, _) in old_elements.items():
+        if key not in new_elements:
+            yield DiffKind.REMOVED, position, el, None
+
+
+def diff_rows(previous_id: int, old: list[dict], av: ActVersion, new: list[dict]):
+    """`act_version_diff` rows of the changes from the previous version to `av`."""
+    for kind, position, old_el, new_el in diff_contents(old, new):
+        el = new_el or old_el
+        yield {
+            "version_id": av.id,
+            "previous_id": previous_id,
+            "act_id": av.act_id,
+            "language": av.language,
+            "date": av.date,
+            "cause_act_code": av.cause_act_code,
+            "kind": kind,
+            "element_id": el.get("id"),
+            "element_type": el.get("type"),
+            "position": position,
+            "change_id": el.get("changeId"),
+            "old_text": old_el.get("text") if old_el else None,
+            "new_text": new_el.get("text") if new_el else None,
+        }
+
+
+def diff_act(s: Session, act_id: int, language: Language) -> tuple[int, int]:
+    """
+    Diff the versions of an act in a language that need it, in the session
+    transaction. Returns the numbers of versions diffed and changes found.
+    """
+    versions = s.exec(
+        select(ActVersion.id, ActVersion.diffed)
+        .where(ActVersion.act_id == act_id, ActVersion.language == language)
+        .order_by(ActVersion.date)
+    ).all()
+    # a new version changes the diff of the next one too
+    todo = {
+        i
+        for i, (_, diffed) in enumerate(versions)
+        if not diffed or (i and not versions[i - 1][1])
+    }
+
+    rows = []
+    previous_id = old = None
+    for i, (version_id, _) in enumerate(versions):
+        if i not in todo and i + 1 not in todo:
+            continue
+        av = s.get(ActVersion, version_id)
+        content = storage.load_content(s, av)
+        if i in todo and previous_id is not None:
+            rows.extend(diff_rows(previous_id, old, av, content))
+        previous_id, old = (version_id, content) if i + 1 in todo else (None, None)
+        s.expunge(av)  # only one content is held at a time
+
+    ids = [versions[i][0] for i in todo]
+    s.exec(delete(ActVersionDiff).where(ActVersionDiff.version_id.in_(ids)))
+    if rows:
+        s.execute(insert(ActVersionDiff), rows)
+    s.exec(update(ActVersion).where(ActVersion.id.in_(ids)).values(diffed=True))
+    return len(ids), len(rows)
+
+
+def diff_versions(batch_size: int = 100) -> Iterator[tuple[int, int]]:
+    """
+    Diff every version not diffed yet, `batch_size` acts per transaction.
+
+    Yields the numbers of versions diffed and changes found by each batch.
+    """
+    while True:
+        with Session(get_engine()) as s:
+            groups = s.exec(
+                select(ActVersion.act_id, ActVersion.language)
+                .where(~ActVersion.diffed)  # in ix_act_version_undiffed
+                .distinct()
+                .limit(batch_size)
+            ).all()
+            if not groups:
+                return
+            diffed = found = 0
+            for act_id, language in groups:
+                d, f = diff_act(s, act_id, language)
+                diffed += d
+                found += f
+            s.commit()
+        yield diffed, found
+
+
+def changes(
+    code: str, language: Language, since: date | None = None
+) -> list[ActVersionDiff]:
+    """Element changes of an act by version date, for a changelog."""
+    with Session(get_engine()) as s:
+        query = (
+            select(ActVersionDiff)
+            .join(Act, Act.id == ActVersionDiff.act_id)
+            .where(Act.code == code, ActVersionDiff.language == language)
+            .order_by(ActVersionDiff.date, ActVersionDiff.position)
+        )
+        if since is not None:
+            query = query.where(ActVersionDiff.date >= since)
+        return s.exec(query).all()
@@ -10,6 +10,16 @@ class Language(str, Enum):
     KAZ = "kaz"
 
 
+class StorageMode(str, Enum):
+    """How act version content is stored."""
+
+    TEXT = "text"  # JSON of the element list in act_version.content
+    ELEMENTS = "elements"  # act_version.element_hashes refer to content_element
+    ZSTD = (
+        "zstd"  # compressed JSON with a trained dictionary in act_version.content_zst
+    )
+
+
 class ContentType(str, Enum):
     """Content element types found in documents."""
 
@@ -129,3 +139,18 @@ class ActStatus(str, Enum):
     BAK = "bak"
     VEXP = "vexp"
     STOP = "stop"
+
+
+class CrawlState(str, Enum):
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+    FAILED = "failed"  # retried with backoff, see frontier.MAX_ATTEMPTS
+
+
+class DiffKind(str, Enum):
+    """How a content element changed from the previous version."""
+
+    ADDED = "added"
+    REMOVED = "removed"
+    MODIFIED = "modified"
@@ -0,0 +1,325 @@
+"""Persistent crawl frontier in Postgres, for ingest runs that resume.
+
+The search listing is walked once per pass. Every listed act gets a row in
+`crawl_frontier` and the listing cursor moves past each recorded page, so an
+interrupted run goes on where it stopped, without walking the listing again.
+Workers claim acts one by one. A failed act is retried with exponential
+backoff, up to `MAX_ATTEMPTS` times per pass.
+
+Any number of ingest processes, on any hosts, can share the frontier. Claims
+are taken with `FOR UPDATE SKIP LOCKED` and kept alive by a heartbeat, the
+claims of a process that stops beating are taken over once `LEASE` is over.
+Only the process holding the `LISTING_LOCK` advisory lock walks the listing.
+"""
+
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from sqlalchemy import and_, or_, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, func, select, update
+
+from .enums import CrawlState
+from .models import CrawlItem, CrawlListing, get_engine
+
+MAX_ATTEMPTS = 5
+# seconds before the second attempt, doubled for every next one
+RETRY_DELAY = 10.0
+
+HEARTBEAT_INTERVAL = 10.0
+# a claim without a heartbeat for this long belongs to a dead process
+LEASE = timedelta(seconds=60)
+
+# pg advisory lock key of the listing walk
+LISTING_LOCK = 7_001_001
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_live = and_(
+    CrawlItem.state == CrawlState.IN_PROGRESS,
+    CrawlItem.heartbeat_at >= func.now() - LEASE,
+)
+_stale = and_(
+    CrawlItem.state == CrawlState.IN_PROGRESS,
+    CrawlItem.heartbeat_at < func.now() - LEASE,
+)
+
+_claimable = or_(
+    CrawlItem.state == CrawlState.PENDING,
+    and_(
+        CrawlItem.state == CrawlState.FAILED,
+        CrawlItem.attempts < MAX_ATTEMPTS,
+        CrawlItem.next_attempt_at <= func.now(),
+    ),
+    and_(_stale, CrawlItem.attempts < MAX_ATTEMPTS),
+)
+
+# work that is left, or will be once a retry is due or a claim expires
+_unfinished = or_(
+    CrawlItem.state == CrawlState.PENDING,
+    _live,
+    and_(
+        or_(CrawlItem.state == CrawlState.FAILED, _stale),
+        CrawlItem.attempts < MAX_ATTEMPTS,
+    ),
+)
+
+
+class ListingLock:
+    """
+    Session level advisory lock on its own connection, held while listing.
+
+    The lock goes away with the connection, so a dead lister never blocks others.
+    """
+
+    def __init__(self):
+        self._conn = None
+
+    def acquire(self) -> bool:
+        conn = get_engine().connect()
+        locked = conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": LISTING_LOCK}
+        ).scalar()
+        conn.commit()
+        if not locked:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def release(self):
+        if self._conn is None:
+            return
+        try:
+            # a session lock outlives transactions, a pooled connection must not keep it
+            self._conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": LISTING_LOCK}
+            )
+            self._conn.commit()
+        finally:
+            self._conn.close()
+            self._conn = None
+
+
+def listing_in_progress() -> bool:
+    """Whether any process is walking the listing now."""
+    with get_engine().connect() as conn:
+        return conn.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' "
+                "AND classid = 0 AND objid = :key AND objsubid = 1 AND granted)"
+            ),
+            {"key": LISTING_LOCK},
+        ).scalar()
+
+
+def _listing(s: Session) -> CrawlListing:
+    listing = s.get(CrawlListing, 1)
+    if listing is None:
+        listing = CrawlListing(id=1)
+        s.add(listing)
+    return listing
+
+
+def _has_work(s: Session) -> bool:
+    return (
+        s.exec(select(CrawlItem.code).where(_unfinished).limit(1)).first() is not None
+    )
+
+
+def has_work() -> bool:
+    with Session(get_engine()) as s:
+        return _has_work(s)
+
+
+def start_pass(start_page: int | None = None, incremental: bool = False) -> int | None:
+    """
+    Prepare the frontier for an ingest run, holding the `ListingLock`.
+
+    A run resumes the unfinished pass. When the last pass is over, a new one
+    starts: the listing is walked again for new acts, acts that failed for good
+    get new attempts and, with `incremental`, ingested acts are synced again.
+    `start_page` walks the listing from that page in any case.
+
+    Returns the listing page to walk from, None when the listing is complete.
+    """
+    new_pass = False
+    with Session(get_engine()) as s:
+        listing = _listing(s)
+        over = listing.completed_at is not None or listing.started_at is None
+        if over and not _has_work(s):
+            new_pass = True
+            listing.next_page = 1
+            listing.completed_at = None
+            listing.started_at = func.now()
+            reset = [CrawlState.FAILED]
+            if incremental:
+                reset.append(CrawlState.DONE)
+            s.exec(
+                update(CrawlItem)
+                .where(or_(CrawlItem.state.in_(reset), _stale))
+                .values(state=CrawlState.PENDING, attempts=0, next_attempt_at=None)
+            )
+        if start_page is not None:
+            listing.next_page = start_page
+            listing.completed_at = None
+        s.add(listing)
+        s.commit()
+
+        if new_pass:
+            print("Starting a new crawl pass")
+        if listing.completed_at is not None:
+            return None
+        return listing.next_page
+
+
+def join_crawl(
+    start_page: int | None = None, incremental: bool = False
+) -> tuple[ListingLock | None, int | None]:
+    """
+    Become the lister of the crawl if no other process is, see `start_pass`.
+
+    Returns the held lock and the listing page to walk from, or Nones when
+    this process only ingests acts.
+    """
+    lock = ListingLock()
+    if not lock.acquire():
+        print("Another process walks the listing, joining its crawl")
+        return None, None
+    try:
+        listing_page = start_pass(start_page, incremental)
+    except BaseException:
+        lock.release()
+        raise
+    if listing_page is None:
+        lock.release()
+        return None, None
+    return lock, listing_page
+
+
+def drained() -> bool:
+    """Whether no work is left and none is coming from the listing."""
+    # in this order, the listing records its pages before it lets the lock go
+    return not listing_in_progress() and not has_work()
+
+
+def record_page(page: int, page_count: int | None, codes: list[str]):
+    """Add the acts of a listing page to the frontier and move the cursor past it."""
+    with Session(get_engine()) as s:
+        if codes:
+            s.exec(
+                insert(CrawlItem)
+                .values(
+                    [
+                        {"code": code, "page": page, "position": position}
+                        for position, code in enumerate(codes)
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=["code"])
+            )
+        listing = _listing(s)
+        listing.next_page = page + 1
+        listing.page_count = page_count
+        s.add(listing)
+        s.commit()
+
+
+def finish_listing():
+    with Session(get_engine()) as s:
+        listing = _listing(s)
+        listing.completed_at = func.now()
+        s.add(listing)
+        s.commit()
+
+
+def claim() -> tuple[str, int] | None:
+    """Take the next act to ingest, return its code and listing page."""
+    with Session(get_engine()) as s:
+        item = s.exec(
+            select(CrawlItem)
+            .where(_claimable)
+            .order_by(CrawlItem.page, CrawlItem.position)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if item is None:
+            return None
+        code, page = item.code, item.page
+        s.exec(
+            update(CrawlItem)
+            .where(CrawlItem.code == code)
+            .values(
+                state=CrawlState.IN_PROGRESS,
+                attempts=CrawlItem.attempts + 1,
+                started_at=func.now(),
+                finished_at=None,
+                claimed_by=WORKER_ID,
+                heartbeat_at=func.now(),
+            )
+        )
+        s.commit()
+        return code, page
+
+
+def heartbeat():
+    """Keep the claims of this process from expiring."""
+    with Session(get_engine()) as s:
+        s.exec(
+            update(CrawlItem)
+            .where(
+                CrawlItem.claimed_by == WORKER_ID,
+                CrawlItem.state == CrawlState.IN_PROGRESS,
+            )
+            .values(heartbeat_at=func.now())
+        )
+        s.commit()
+
+
+def keep_alive(stop: threading.Event):
+    """Beat every `HEARTBEAT_INTERVAL` until `stop` is set, run it in a thread."""
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            heartbeat()
+        except Exception as e:
+            print("Heartbeat failed:", e)
+
+
+def finish(code: str):
+    """Mark a claimed act as ingested, unless another process has taken it over."""
+    with Session(get_engine()) as s:
+        s.exec(
+            update(CrawlItem)
+            .where(CrawlItem.code == code, CrawlItem.claimed_by == WORKER_ID)
+            .values(state=CrawlState.DONE, last_error=None, finished_at=func.now())
+        )
+        s.commit()
+
+
+def fail(code: str, error: BaseException):
+    """Record a failed attempt, the act is claimable again after a backoff."""
+    with Session(get_engine()) as s:
+        attempts = s.exec(
+            select(CrawlItem.attempts).where(CrawlItem.code == code)
+        ).one()
+        delay = timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1))
+        s.exec(
+            update(CrawlItem)
+            .where(CrawlItem.code == code, CrawlItem.claimed_by == WORKER_ID)
+            .values(
+                state=CrawlState.FAILED,
+                last_error=f"{type(error).__name__}: {error}",
+                finished_at=func.now(),
+                next_attempt_at=func.now() + delay,
+            )
+        )
+        s.commit()
+
+
+def summary() -> dict[CrawlState, int]:
+    with Session(get_engine()) as s:
+        rows = s.exec(
+            select(CrawlItem.state, func.count()).group_by(CrawlItem.state)
+        ).all()
+    return {state: count for state, count in rows}
@@ -0,0 +1,303 @@
+"""Export of act versions into a git history with `git fast-import`.
+
+Versions are streamed from the database in date order through a server-side
+cursor, rendered to Markdown by `render` and written out as blobs right away.
+Every version date becomes one commit that points to the blobs of that date.
+An act keeps a single file per language, so `git log` of the file is the
+history of the act.
+
+The exported versions are recorded in a `Manifest` inside `.git`. Next exports
+add commits for the versions that changed since, on top of the branch.
+"""
+
+import subprocess
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+from itertools import batched, groupby
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Sequence
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from .manifest import Key, Manifest, diff, version_keys
+from .models import ActVersion, get_engine
+from .render import DEFAULT_CACHE_DIR, DEFER_CONTENT, MarkdownCache, Renderer
+
+AUTHOR = b"qaz-law <qaz-law@zan.gov.kz>"
+# acts take effect by the Astana time
+TZ = timezone(timedelta(hours=5))
+
+ACT_PATHS = text(
+    """
+    SELECT a.id, a.code, min(t.code)
+    FROM act AS a
+    LEFT JOIN act_type_link AS l ON l.act_id = a.id
+    LEFT JOIN act_type AS t ON t.id = l.type_id
+    GROUP BY a.id, a.code
+    """
+)
+
+
+def act_dirs(s: Session) -> dict[int, str]:
+    """Directory of every act, by act id: `<type>/<code>`."""
+    return {
+        act_id: f"{(type_name or 'other').lower()}/{code}"
+        for act_id, code, type_name in s.execute(ACT_PATHS)
+    }
+
+
+def version_path(act_dir: str, av: ActVersion) -> str:
+    return f"{act_dir}/{av.language.value}.md"
+
+
+def key_path(dirs: dict[int, str], key: Key) -> str:
+    act_id, _, language = key
+    return f"{dirs[act_id]}/{language}.md"
+
+
+def version_key(av: ActVersion) -> Key:
+    return av.act_id, av.date.isoformat(), av.language.value
+
+
+def manifest_path(repo: Path, branch: str) -> Path:
+    return repo / ".git" / "qaz-law" / f"{branch}.sqlite"
+
+
+def rendered_versions(
+    s: Session, renderer: Renderer, batch_size: int = 500
+) -> Iterator[tuple[ActVersion, str]]:
+    """All act versions by date with their Markdown, through a server-side cursor."""
+    versions = s.exec(
+        select(ActVersion)
+        .options(*DEFER_CONTENT)
+        .order_by(ActVersion.date, ActVersion.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in versions.partitions():
+        yield from zip(batch, renderer.render(s, batch))
+        s.expunge_all()  # the identity map would keep the whole table
+
+
+def _data(out: BinaryIO, payload: bytes):
+    out.write(b"data %d\n" % len(payload))
+    out.write(payload)
+    out.write(b"\n")
+
+
+def commit_message(
+    day: date, files: list[tuple[str, int, ActVersion]], deletes: Sequence[str] = ()
+) -> str:
+    title = f"{day.isoformat()}: {len(files)} version{'s' * (len(files) != 1)}"
+    if deletes:
+        title += f", {len(deletes)} removed"
+    lines = [title, ""]
+    for path, _, av in files:
+        line = path
+        if av.cause_act_code:
+            line += f", caused by {av.cause_act_code}"
+        lines.append(line)
+    lines.extend(f"{path}, removed" for path in deletes)
+    return "\n".join(lines) + "\n"
+
+
+def write_blob(out: BinaryIO, mark: int, markdown: str):
+    out.write(b"blob\nmark :%d\n" % mark)
+    _data(out, markdown.encode())
+
+
+def write_commit(
+    out: BinaryIO,
+    branch: str,
+    day: date,
+    files: list[tuple[str, int, ActVersion]],
+    deletes: Sequence[str] = (),
+    parent: bool = False,
+):
+    """
+    One fast-import commit with the (path, blob mark, version) files of a date.
+
+    With `parent` the commit goes on top of the branch as it is in the
+    repository, for the first commit of an incremental import.
+    """
+    # git has no dates before the epoch
+    timestamp = max(
+        int(datetime(day.year, day.month, day.day, tzinfo=TZ).timestamp()), 0
+    )
+    who = b"%s %d +0500" % (AUTHOR, timestamp)
+
+    out.write(b"commit refs/heads/%s\n" % branch.encode())
+    out.write(b"author %s\ncommitter %s\n" % (who, who))
+    _data(out, commit_message(day, files, deletes).encode())
+    if parent:
+        out.write(b"from refs/heads/%s^0\n" % branch.encode())
+    for path, mark, _ in files:
+        out.write(b"M 100644 :%d %s\n" % (mark, path.encode()))
+    for path in deletes:
+        out.write(b"D %s\n" % path.encode())
+    out.write(b"\n")
+
+
+def write_days(
+    out: BinaryIO,
+    branch: str,
+    dirs: dict[int, str],
+    rows: Iterable[tuple[ActVersion, str]],
+    manifest: Manifest | None = None,
+    parent: bool = False,
+) -> int:
+    """Write a commit per date of the versions by date, return the commits count."""
+    commits = mark = 0
+    for day, day_rows in groupby(rows, key=lambda r: r[0].date):
+        files = []
+        for av, markdown in day_rows:
+            mark += 1
+            write_blob(out, mark, markdown)
+            path = version_path(dirs[av.act_id], av)
+            files.append((path, mark, av))
+            if manifest is not None:
+                manifest.put(version_key(av), av.content_hash, path)
+        write_commit(out, branch, day, files, parent=parent and not commits)
+        commits += 1
+    return commits
+
+
+def write_history(
+    out: BinaryIO,
+    renderer: Renderer,
+    branch: str = "main",
+    batch_size: int = 500,
+    manifest: Manifest | None = None,
+) -> int:
+    """Write the fast-import stream of the whole history, return the commits count."""
+    with Session(get_engine()) as s:
+        dirs = act_dirs(s)
+        rows = rendered_versions(s, renderer, batch_size)
+        return write_days(out, branch, dirs, rows, manifest)
+
+
+def write_updates(
+    out: BinaryIO,
+    renderer: Renderer,
+    manifest: Manifest,
+    branch: str = "main",
+    batch_size: int = 500,
+) -> int:
+    """
+    Write commits on top of `branch` for the versions that changed since the
+    export in `manifest`, return the commits count.
+
+    History is never rewritten: a version older than the latest exported one of
+    its act and language is only recorded, its file already has later content.
+    Rebuild the branch to place such versions. Files of acts that are gone are
+    removed by a last commit.
+    """
+    with Session(get_engine()) as s:
+        dirs = act_dirs(s)
+        path_of = partial(key_path, dirs)
+        updates: list[tuple[Key, int]] = []
+        deletes: set[str] = set()
+        gone: list[tuple[Key, str]] = []
+        changes = diff(version_keys(s), manifest.entries(), path_of)
+        for key, version_id, content_hash, old_path in changes:
+            if version_id is None:
+                gone.append((key, old_path))
+                continue
+            if old_path is not None and old_path != path_of(key):
+                deletes.add(old_path)  # the act has moved to another type
+            latest = manifest.latest(key[0], key[2])
+            if latest is None or key[1] >= latest:
+                updates.append((key, version_id))
+            else:
+                manifest.put(key, content_hash, path_of(key))
+        for key, path in gone:
+            manifest.remove(key)
+        for key, path in gone:
+            if manifest.latest(key[0], key[2]) is None:
+                deletes.add(path)
+        deletes -= {path_of(key) for key, _ in updates}
+
+        updates.sort(key=lambda u: (u[0][1], u[1]))  # by date
+
+        def rows() -> Iterator[tuple[ActVersion, str]]:
+            for batch in batched(updates, batch_size):
+                ids = [version_id for _, version_id in batch]
+                found = {
+                    av.id: av
+                    for av in s.exec(
+                        select(ActVersion)
+                        .where(ActVersion.id.in_(ids))
+                        .options(*DEFER_CONTENT)
+                    )
+                }
+                versions = [found[i] for i in ids if i in found]
+                yield from zip(versions, renderer.render(s, versions))
+                s.expunge_all()
+
+        commits = write_days(out, branch, dirs, rows(), manifest, parent=True)
+        if deletes:
+            write_commit(
+                out, branch, date.today(), [], sorted(deletes), parent=not commits
+            )
+            commits += 1
+        return commits
+
+
+def export_git(
+    repo: str | Path,
+    branch: str = "main",
+    batch_size: int = 500,
+    processes: int | None = None,
+    cache_dir: str | Path | None = DEFAULT_CACHE_DIR,
+    full: bool = False,
+) -> int:
+    """
+    Export the database into `branch` of the git repository at `repo`.
+
+    The repository is created when missing. Commits are added for the versions
+    that changed since the last export, the branch is rebuilt from scratch when
+    it has no manifest yet or with `full`. Check the branch out again afterwards.
+    Versions are rendered by `processes` processes, through a Markdown cache in
+    `cache_dir` unless it is None. Returns the number of commits.
+    """
+    repo = Path(repo)
+    if not (repo / ".git").exists():
+        subprocess.run(["git", "init", "-q", "-b", branch, str(repo)], check=True)
+    has_branch = (
+        subprocess.run(
+            ["git", "rev-parse", "--verify", "-q", f"refs/heads/{branch}"],
+            cwd=repo,
+            capture_output=True,
+        ).returncode
+        == 0
+    )
+
+    cache = MarkdownCache(cache_dir) if cache_dir is not None else None
+    with Manifest(manifest_path(repo, branch)) as manifest:
+        incremental = has_branch and not full and not manifest.is_empty()
+        if not incremental:
+            manifest.clear()
+        proc = subprocess.Popen(
+            ["git", "fast-import", "--quiet", "--force"],
+            cwd=repo,
+            stdin=subprocess.PIPE,
+        )
+        try:
+            with Renderer(processes, cache) as renderer:
+                if incremental:
+                    commits = write_updates(
+                        proc.stdin, renderer, manifest, branch, batch_size
+                    )
+                else:
+                    commits = write_history(
+                        proc.stdin, renderer, branch, batch_size, manifest
+                    )
+            proc.stdin.close()
+        except BaseException:
+            proc.kill()
+            raise
+        if proc.wait() != 0:
+            raise RuntimeError(f"git fast-import failed with code {proc.returncode}")
+        # recorded only once git has the commits, a failed import changes nothing
+        manifest.commit()
+    return commits
@@ -0,0 +1,327 @@
+"""Asyncio ingest pipeline.
+
+Network work runs on the event loop through `aclient`, so a handful of acts can
+keep hundreds of requests in flight. Database work stays synchronous and is
+pushed to a thread with `asyncio.to_thread`, one session per act, as in `ingest_pg`.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from httpx import HTTPStatusError
+from sqlmodel import Session, select
+
+from . import aclient, frontier, metrics, models
+from .crawler import DEFAULT_PREFETCH
+from .ingest_pg import (
+    DEFAULT_FAN_OUT,
+    EXTRA_CONNECTIONS,
+    POLL_INTERVAL,
+    TROUBLED_CODES,
+    append_versions,
+    build_act,
+    dedup_versions,
+    init_db,
+    missing_versions,
+    print_frontier,
+    stored_version_keys,
+    write_versions,
+)
+from .enums import Language
+from .models import Act, get_engine
+from .schemas import Document, MultiLangDocument, VersionInfo
+
+
+async def get_document_or_none(doc_id: str, language: str) -> Document | None:
+    try:
+        return await aclient.get_document(doc_id, language)
+    except HTTPStatusError as e:
+        if e.response.status_code == 404:
+            # not every document has both language versions
+            return None
+        raise
+
+
+async def get_latest_documents(doc_id: str):
+    ru, kz = await asyncio.gather(
+        get_document_or_none(doc_id, "rus"),
+        get_document_or_none(doc_id, "kaz"),
+    )
+    return ru, kz
+
+
+async def _limited(limit: asyncio.Semaphore, coro):
+    async with limit:
+        return await coro
+
+
+async def fetch_page(doc_id: str, language: str, version_date, page: int = 1):
+    with metrics.stage("fetch_page"):
+        return await aclient.get_document(doc_id, language, version_date, page=page)
+
+
+async def fetch_version(
+    doc_id: str, language: str, version_date, limit: asyncio.Semaphore
+) -> Document:
+    v_doc = await _limited(limit, fetch_page(doc_id, language, version_date))
+    # the document can have multiple pages, we will extend the content with them
+    page_docs = await asyncio.gather(
+        *(
+            _limited(limit, fetch_page(doc_id, language, version_date, page))
+            for page in range(2, v_doc.pages_count + 1)
+        )
+    )
+    for page_doc in page_docs:
+        v_doc.content.extend(page_doc.content)
+    return v_doc
+
+
+async def fetch_versions(doc: Document, limit: asyncio.Semaphore) -> list[Document]:
+    with metrics.stage("list_versions"):
+        versions = await _limited(
+            limit, aclient.get_document_versions(doc.id, doc.language)
+        )
+    return list(
+        await asyncio.gather(
+            *(
+                fetch_version(doc.id, doc.language, v.version_date, limit)
+                for v in dedup_versions(versions)
+            )
+        )
+    )
+
+
+async def get_versions_or_empty(doc_id: str, language: str) -> list[VersionInfo]:
+    try:
+        return await aclient.get_document_versions(doc_id, language)
+    except HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return []  # not every document has both language versions
+        raise
+
+
+def load_stored_versions(code: str) -> tuple[int, set] | None:
+    """Return the act id and its stored (language, date) pairs, None for a new act."""
+    with Session(get_engine()) as session:
+        act_id = session.exec(select(Act.id).where(Act.code == code)).first()
+        if act_id is None:
+            return None
+        return act_id, stored_version_keys(act_id, session)
+
+
+def persist_act(ml_act: MultiLangDocument, v_docs: list[Document]) -> int:
+    """Write a fully fetched act with its versions in a single transaction."""
+    with Session(get_engine()) as session:
+        act = build_act(ml_act, session)
+        vc = write_versions(act, v_docs, session)
+        with metrics.stage("commit"):
+            session.commit()
+        return vc
+
+
+def persist_new_versions(act_id: int, v_docs: list[Document]):
+    with Session(get_engine()) as session:
+        act = session.get(Act, act_id)
+        append_versions(act, v_docs, session)
+        with metrics.stage("commit"):
+            session.commit()
+
+
+async def sync_act(
+    code: str, act_id: int, stored: set, limit: asyncio.Semaphore
+) -> int:
+    """Fetch and add only the versions missing from an already ingested act."""
+    with metrics.stage("list_versions"):
+        listings = await asyncio.gather(
+            *(
+                _limited(limit, get_versions_or_empty(code, language.value))
+                for language in Language
+            )
+        )
+    missing = [v for listing in listings for v in missing_versions(listing, stored)]
+    if not missing:
+        return 0
+
+    v_docs = await asyncio.gather(
+        *(fetch_version(code, v.language, v.version_date, limit) for v in missing)
+    )
+    await asyncio.to_thread(persist_new_versions, act_id, list(v_docs))
+    metrics.inc("versions_total", len(v_docs))
+    return len(v_docs)
+
+
+async def process_doc(
+    page: int,
+    code: str,
+    fan_out: int = DEFAULT_FAN_OUT,
+    incremental: bool = False,
+):
+    if code in TROUBLED_CODES:
+        print(f"Skipping {code}")
+        return
+
+    stored = await asyncio.to_thread(load_stored_versions, code)
+    if stored and not incremental:
+        return
+
+    t1 = time.time()
+    limit = asyncio.Semaphore(fan_out)  # requests in flight for this act
+
+    if stored:
+        act_id, keys = stored
+        vc = await sync_act(code, act_id, keys, limit)
+        metrics.inc("acts_total", result="synced")
+        if vc:
+            print(
+                asyncio.current_task().get_name(),
+                "page",
+                page,
+                "act",
+                code,
+                f"(+{vc} ver)",
+                f"[{time.time() - t1:.02f}s]",
+            )
+        return
+
+    with metrics.stage("fetch_latest"):
+        ru, kz = await get_latest_documents(code)
+    if not (ru or kz):
+        print(code, "no documents found")
+        return
+
+    ml_act = MultiLangDocument(kaz=kz, rus=ru)
+    v_docs = []
+    for docs in await asyncio.gather(
+        *(fetch_versions(doc, limit) for doc in ml_act.docs)
+    ):
+        v_docs.extend(docs)
+
+    vc = await asyncio.to_thread(persist_act, ml_act, v_docs)
+    metrics.inc("acts_total", result="new")
+    metrics.inc("versions_total", vc)
+    metrics.observe("act_seconds", time.time() - t1)
+    print(
+        asyncio.current_task().get_name(),
+        "page",
+        page,
+        "act",
+        code,
+        f"({vc} ver)",
+        f"[{time.time() - t1:.02f}s]",
+    )
+
+
+async def walk_listing(start_page: int, prefetch: int, lock: frontier.ListingLock):
+    """Record the search listing into the crawl frontier, then let `lock` go."""
+    try:
+        page, codes = start_page, []
+        async for doc_page, doc_meta in aclient.iterate_documents(
+            start_page, prefetch=prefetch, per_page=100
+        ):
+            if doc_page != page:
+                await asyncio.to_thread(frontier.record_page, page, None, codes)
+                page, codes = doc_page, []
+            codes.append(doc_meta.id)
+        await asyncio.to_thread(frontier.record_page, page, None, codes)
+        await asyncio.to_thread(frontier.finish_listing)
+        print("No more documents to list")
+    finally:
+        await asyncio.to_thread(lock.release)
+
+
+async def _worker(fan_out: int, incremental: bool):
+    while True:
+        claimed = await asyncio.to_thread(frontier.claim)
+        if claimed is None:
+            if await asyncio.to_thread(frontier.drained):
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        code, page = claimed
+        try:
+            with metrics.busy("workers_busy"):
+                await process_doc(page, code, fan_out, incremental)
+        except Exception as e:
+            print(f"Worker failed on {code}: {e}")
+            metrics.inc("acts_total", result="failed")
+            await asyncio.to_thread(frontier.fail, code, e)
+        else:
+            await asyncio.to_thread(frontier.finish, code)
+
+
+async def _ingest_all(
+    lock: frontier.ListingLock | None,
+    listing_page: int | None,
+    max_acts: int,
+    fan_out: int,
+    prefetch: int,
+    incremental: bool,
+):
+    listing = None
+    if lock is not None:
+        listing = asyncio.create_task(walk_listing(listing_page, prefetch, lock))
+    workers = [
+        asyncio.create_task(_worker(fan_out, incremental), name=f"task_{i}")
+        for i in range(max_acts)
+    ]
+    try:
+        await asyncio.gather(*workers)
+        if listing is not None and listing.exception():
+            print("Error running ingestion loop:", listing.exception())
+    finally:
+        for task in [listing, *workers]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*filter(None, [listing, *workers]), return_exceptions=True)
+        await aclient.aclose()
+
+
+def ingest_all(
+    recreate: bool,
+    start_page: int | None = None,
+    max_acts: int = 20,
+    concurrency: int = aclient.DEFAULT_CONCURRENCY,
+    fan_out: int = DEFAULT_FAN_OUT,
+    prefetch: int = DEFAULT_PREFETCH,
+    incremental: bool = False,
+):
+    """
+    Ingest all acts with asyncio.
+
+    `max_acts` acts are processed at once, while `concurrency` limits
+    the number of requests in flight across all of them
+    and `fan_out` limits it for a single act.
+    """
+    if models.pool_size is None:
+        # database work runs in the default executor, at most that many at once
+        threads = min(32, (os.cpu_count() or 1) + 4)
+        models.configure(size=min(max_acts, threads) + EXTRA_CONNECTIONS)
+    init_db(recreate=recreate)
+    models.prewarm()
+    metrics.registry.gauge_function("db_connections_in_use", models.connections_in_use)
+    metrics.registry.gauge_function(
+        "frontier_acts", frontier.summary, label="state", every=30
+    )
+    lock, listing_page = frontier.join_crawl(start_page, incremental)
+    aclient.configure(concurrency=concurrency)
+    aclient.client.limiter.max_concurrency = concurrency
+    alive = threading.Event()
+    threading.Thread(
+        target=frontier.keep_alive, args=(alive,), name="heartbeat", daemon=True
+    ).start()
+
+    try:
+        asyncio.run(
+            _ingest_all(lock, listing_page, max_acts, fan_out, prefetch, incremental)
+        )
+    except KeyboardInterrupt:
+        print("\nCtrl+C received. Exited due to user interrupt")
+        return
+    finally:
+        alive.set()
+
+    print("All running tasks are finished")
+    print_frontier()
@@ -1,24 +1,51 @@
-import json
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
 from datetime import date
 
 from httpx import HTTPStatusError
-from sqlmodel import Session, select, SQLModel
+from sqlalchemy import text
+from sqlmodel import Session, select, SQLModel, func, update
 
+from . import frontier, metrics, models, storage
+from .budget import DEFAULT_LIMIT, ByteBudget
+from .bulk import VersionWriter, copy_act_versions
 from .client import (
     get_document_versions,
     get_document,
-    iterate_documents,
+    get_document_page,
 )
-from .enums import ActTypeEnum
-from .models import Act, engine, ActType, ActVersion
-from .schemas import MultiLangDocument, Document, SearchActMetadata
+from .crawler import DEFAULT_PREFETCH, SearchCrawler
+from .enums import ActTypeEnum, Language
+from .models import Act, get_engine, ActType, ActVersion, SCHEMA_UPGRADES
+from .schemas import MultiLangDocument, Document, VersionInfo
 
 _thread_cache = threading.local()
 
 
+# max number of requests in flight for a single act
+DEFAULT_FAN_OUT = 8
+
+# seconds between frontier polls of an idle worker
+POLL_INTERVAL = 1.0
+
+# connections of an ingest besides one per worker: the listing lock, the
+# listing and the heartbeat
+EXTRA_CONNECTIONS = 3
+
+# reserved for a document page before its size is known
+PAGE_ESTIMATE = 512 * 1024
+
+# response bytes held by all workers, see `ingest_all`
+budget = ByteBudget()
+
+
 TROUBLED_CODES = [
     "2574",  # ru/kz разные документы
 ]
@@ -49,10 +76,14 @@ def get_act_types(session) -> dict[str, ActType]:
 
 
 def init_db(recreate=False):
+    engine = get_engine()
     if recreate:
         SQLModel.metadata.drop_all(engine)
 
     SQLModel.metadata.create_all(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
 
     # create act types if not created yet
     with Session(engine) as session:
@@ -88,7 +119,7 @@ def get_latest_documents(doc_id: str):
     return ru, kz
 
 
-def construct_act_version(doc: Document):
+def version_values(doc: Document) -> dict:
     # ensure actual_version is the same for all languages
     #
     # NOTE there are documents that have different actual versions by a language.
@@ -98,33 +129,44 @@ def construct_act_version(doc: Document):
     #
     # assert len({doc.actual_version for doc in version_docs.docs}) == 1
 
-    av = ActVersion(
+    values = dict(
         date=doc.version_date,
         language=doc.language,
         is_actual=doc.actual_version,
         version_id=doc.version.id,
-        content=json.dumps(doc.content, ensure_ascii=False),
         pages_count=doc.pages_count,
     )
     if doc.version.cause and doc.version.cause.code:
-        av.cause_act_code = doc.version.cause.code
-    return av
-
-
-def construct_act(doc_id: str, s: Session) -> Act | None:
-    """
-    Construct a single act, together with its versions and language contents.
-
-    Do not follow cause documents, write them as a string into an act version instead.
-        We will link them together as a second step when all acts are here.
-    """
-    ru, kz = get_latest_documents(doc_id)
-    if not (ru or kz):
-        print(doc_id, "no documents found")
-        return None
-
-    ml_act = MultiLangDocument(kaz=kz, rus=ru)
-
+        values["cause_act_code"] = doc.version.cause.code
+    return values
+
+
+def write_versions(act: Act, v_docs: list[Document], s: Session) -> int:
+    """Stream versions of a flushed act into the database with COPY."""
+    with metrics.stage("serialize"):
+        rows = [
+            {
+                "act_id": act.id,
+                **version_values(v_doc),
+                **storage.encode_content(s, v_doc.content),
+            }
+            for v_doc in v_docs
+        ]
+    return copy_act_versions(s, rows)
+
+
+def dedup_versions(versions: list[VersionInfo]) -> list[VersionInfo]:
+    # should be unique by date and language
+    dedup: dict[tuple[str, date], VersionInfo] = {}
+    for v in versions:
+        key = (v.language, v.version_date)
+        if key not in dedup:
+            dedup[key] = v
+    return list(dedup.values())
+
+
+def build_act(ml_act: MultiLangDocument, s: Session) -> Act:
+    """Create and flush an act row from the latest documents, without versions."""
     act = Act(
         code=ml_act.code,
         sa_doc_number_ru=ml_act.rus.metadata.state_agency_doc_number
@@ -146,121 +188,466 @@ def construct_act(doc_id: str, s: Session) -> Act | None:
     )
     s.add(act)
     s.flush()
+    return act
+
+
+class VersionStream:
+    """A version being fetched, its pages are encoded in order as they arrive."""
+
+    def __init__(
+        self,
+        doc_id: str,
+        language: str,
+        version_date: date,
+        encoder: storage.ContentEncoder,
+    ):
+        self.doc_id = doc_id
+        self.language = language
+        self.version_date = version_date
+        self.encoder = encoder
+        self.doc: Document | None = None  # first page, without content
+
+        # pages that arrived ahead of their turn, with their response sizes
+        self._pages: dict[int, tuple[Document, int]] = {}
+        self._next_page = 1
+
+    @property
+    def held(self) -> int:
+        """Bytes held by the version, encoded content and waiting pages."""
+        return self.encoder.size + sum(size for _, size in self._pages.values())
+
+    def add_page(self, page: int, doc: Document, size: int):
+        self._pages[page] = (doc, size)
+        while self._next_page in self._pages:
+            page_doc, _ = self._pages.pop(self._next_page)
+            with metrics.stage("serialize"):
+                self.encoder.add(page_doc.content)
+            if self._next_page == 1:
+                page_doc.content = []
+                self.doc = page_doc
+            self._next_page += 1
+
+    @property
+    def complete(self) -> bool:
+        return self.doc is not None and self._next_page > self.doc.pages_count
+
+
+def stream_versions(
+    act: Act,
+    targets: list[tuple[str, str, date]],
+    executor: ThreadPoolExecutor,
+    s: Session,
+    fan_out: int = DEFAULT_FAN_OUT,
+) -> list[Document]:
+    """
+    Fetch (doc_id, language, version_date) versions with all their pages, and hand
+    every version to the writer as soon as its last page is in.
+
+    Pages are encoded right when their turn comes, so only the encoded content of
+    unfinished versions is held. Finished versions go to a `VersionWriter`, which
+    copies them in batches, so the bytes it holds are bounded by its batch size
+    rather than by `budget`. Every request reserves bytes in `budget` first.
+    The act blocks on the budget only while it holds none, otherwise it waits for
+    its own requests to free some, so acts never wait for each other in a cycle.
 
-    for doc in ml_act.docs:
-        versions = get_document_versions(doc.id, doc.language)
-
-        # should be unique by date and language
-        dedup_versions: dict[tuple[str, date], Document] = {}
-        for v in versions:
-            key = (v.language, v.version_date)
-            if key not in dedup_versions:
-                dedup_versions[key] = v
-
-        v_docs = []
-        for v in dedup_versions.values():
-            v_doc = get_document(doc.id, doc.language, v.version_date)
-            for additional_page in range(2, v_doc.pages_count + 1):
-                # the document can have multiple pages, we will extend the content with them
-                page_doc = get_document(
-                    doc.id, doc.language, v.version_date, page=additional_page
+    Returns the first pages of the written versions, without content.
+    """
+    requests = deque((VersionStream(*t, storage.ContentEncoder(s)), 1) for t in targets)
+    pending: dict[Future, tuple[VersionStream, int]] = {}
+    writer = VersionWriter(s)
+    held = 0
+    written = []
+    try:
+        while requests or pending:
+            while requests and len(pending) < fan_out:
+                if not held:
+                    budget.acquire(PAGE_ESTIMATE)
+                elif not pending:
+                    # nothing in flight, only this act can free its bytes
+                    budget.charge(PAGE_ESTIMATE)
+                elif not budget.try_acquire(PAGE_ESTIMATE):
+                    break
+                held += PAGE_ESTIMATE
+                version, page = requests.popleft()
+                f = executor.submit(
+                    fetch_page,
+                    version.doc_id,
+                    version.language,
+                    version.version_date,
+                    page,
                 )
-                v_doc.content.extend(page_doc.content)
+                pending[f] = (version, page)
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                version, page = pending.pop(f)
+                doc, size = f.result()
+                if page == 1:
+                    # finish started versions first, they free their bytes when written
+                    requests.extendleft(
+                        (version, p) for p in range(doc.pages_count, 1, -1)
+                    )
+
+                # the reservation becomes what the version holds after encoding
+                before = version.held
+                version.add_page(page, doc, size)
+                delta = version.held - before - PAGE_ESTIMATE
+                if delta > 0:
+                    budget.charge(delta)
+                else:
+                    budget.release(-delta)
+                held += delta
+
+                if version.complete:
+                    version_held = version.held
+                    with metrics.stage("serialize"):
+                        values = version.encoder.values()
+                    writer.add(
+                        {"act_id": act.id, **version_values(version.doc), **values},
+                        version_held,
+                    )
+                    budget.release(version_held)
+                    held -= version_held
+                    written.append(version.doc)
+                    metrics.inc("versions_total")
+        writer.flush()
+        return written
+    except BaseException:
+        # do not waste requests on an act that has failed already
+        for f in pending:
+            f.cancel()
+        raise
+    finally:
+        budget.release(held)
+
+
+def fetch_page(
+    doc_id: str, language: str, version_date: date, page: int
+) -> tuple[Document, int]:
+    with metrics.stage("fetch_page"):
+        return get_document_page(doc_id, language, version_date, page)
+
+
+def version_targets(
+    docs: list[Document], executor: ThreadPoolExecutor
+) -> list[tuple[str, str, date]]:
+    """Every version of the documents, in the order of the version listings."""
+    with metrics.stage("list_versions"):
+        listings = [
+            executor.submit(get_document_versions, doc.id, doc.language) for doc in docs
+        ]
+        return [
+            (doc.id, doc.language, v.version_date)
+            for doc, listing in zip(docs, listings)
+            for v in dedup_versions(listing.result())
+        ]
+
+
+def get_versions_or_empty(doc_id: str, language: str) -> list[VersionInfo]:
+    try:
+        return get_document_versions(doc_id, language)
+    except HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return []  # not every document has both language versions
+        raise
+
+
+def count_versions(act_id: int, s: Session) -> int:
+    return s.exec(
+        select(func.count()).select_from(ActVersion).where(ActVersion.act_id == act_id)
+    ).one()
+
+
+def stored_version_keys(act_id: int, s: Session) -> set[tuple[Language, date]]:
+    rows = s.exec(
+        select(ActVersion.language, ActVersion.date).where(ActVersion.act_id == act_id)
+    ).all()
+    return {(language, d) for language, d in rows}
+
+
+def missing_versions(
+    listing: list[VersionInfo], stored: set[tuple[Language, date]]
+) -> list[VersionInfo]:
+    return [
+        v
+        for v in dedup_versions(listing)
+        if (Language(v.language), v.version_date) not in stored
+    ]
+
+
+def supersede_versions(act: Act, v_docs: list[Document], s: Session):
+    """Update an ingested act for its newly written versions."""
+    # a new actual version supersedes the stored one
+    for v_doc in v_docs:
+        if v_doc.actual_version:
+            s.exec(
+                update(ActVersion)
+                .where(
+                    ActVersion.act_id == act.id,
+                    ActVersion.language == Language(v_doc.language),
+                    ActVersion.date != v_doc.version_date,
+                )
+                .values(is_actual=False)
+            )
+
+    if v_docs:
+        latest = max(v_docs, key=lambda d: d.version_date)
+        if latest.metadata.status:
+            act.status = latest.metadata.status
+
 
-            v_docs.append(v_doc)
+def append_versions(act: Act, v_docs: list[Document], s: Session):
+    """Add newly published versions to an ingested act."""
+    write_versions(act, v_docs, s)
+    supersede_versions(act, v_docs, s)
 
-        for v_doc in v_docs:
-            act.versions.append(construct_act_version(v_doc))
-            s.flush()  # make flush for every version to avoid sending a huge data packet on commit
 
+def sync_act(act: Act, s: Session, fan_out: int = DEFAULT_FAN_OUT) -> int:
+    """
+    Fetch and add only the versions missing from an already ingested act.
+
+    Version listings are compared against the stored (language, date) pairs,
+    so an unchanged act costs two small requests.
+    Returns the number of added versions.
+    """
+    stored = stored_version_keys(act.id, s)
+    with ThreadPoolExecutor(
+        max_workers=fan_out,
+        thread_name_prefix=f"{threading.current_thread().name}-fetch",
+    ) as executor:
+        with metrics.stage("list_versions"):
+            listings = [
+                executor.submit(get_versions_or_empty, act.code, language.value)
+                for language in Language
+            ]
+            missing = [
+                v
+                for listing in listings
+                for v in missing_versions(listing.result(), stored)
+            ]
+        if not missing:
+            return 0
+
+        v_docs = stream_versions(
+            act,
+            [(act.code, v.language, v.version_date) for v in missing],
+            executor,
+            s,
+            fan_out,
+        )
+
+    supersede_versions(act, v_docs, s)
+    return len(v_docs)
+
+
+def construct_act(
+    doc_id: str, s: Session, fan_out: int = DEFAULT_FAN_OUT
+) -> Act | None:
+    """
+    Construct a single act, together with its versions and language contents.
+
+    Do not follow cause documents, write them as a string into an act version instead.
+        They are linked as a second step when all acts are here, see `links`.
+
+    Up to `fan_out` requests of the act are in flight at once, and every version
+    is written as soon as it is fetched.
+    """
+    with metrics.stage("fetch_latest"):
+        ru, kz = get_latest_documents(doc_id)
+    if not (ru or kz):
+        print(doc_id, "no documents found")
+        return None
+
+    ml_act = MultiLangDocument(kaz=kz, rus=ru)
+    act = build_act(ml_act, s)
+
+    with ThreadPoolExecutor(
+        max_workers=fan_out,
+        thread_name_prefix=f"{threading.current_thread().name}-fetch",
+    ) as executor:
+        targets = version_targets(ml_act.docs, executor)
+        stream_versions(act, targets, executor, s, fan_out)
     return act
 
 
-def process_doc(page: int, doc_meta: SearchActMetadata):
-    if doc_meta.id in TROUBLED_CODES:
-        print(f"Skipping {doc_meta.id}")
+def process_doc(
+    page: int,
+    code: str,
+    fan_out: int = DEFAULT_FAN_OUT,
+    incremental: bool = False,
+):
+    if code in TROUBLED_CODES:
+        print(f"Skipping {code}")
         return
 
-    with Session(engine) as session:
-        act = session.exec(select(Act).where(Act.code == doc_meta.id)).first()
-        if act:
+    with Session(get_engine()) as session:
+        # only the id, an ingested act is loaded when it is synced
+        act_id = session.exec(select(Act.id).where(Act.code == code)).first()
+        if act_id is not None and incremental:
+            t1 = time.time()
+            act = session.get(Act, act_id)
+            vc = sync_act(act, session, fan_out=fan_out)
+            metrics.inc("acts_total", result="synced")
+            if vc:
+                with metrics.stage("commit"):
+                    session.commit()
+                print(
+                    threading.current_thread().name,
+                    "page",
+                    page,
+                    "act",
+                    code,
+                    f"(+{vc} ver)",
+                    f"[{time.time() - t1:.02f}s]",
+                )
+            return
+        elif act_id is not None:
             # print(
             #     "page",
             #     page,
             #     "act",
-            #     doc_meta.id,
+            #     code,
             #     "already ingested",
             # )
             return
 
         t1 = time.time()
-        act = construct_act(doc_meta.id, session)
+        act = construct_act(code, session, fan_out=fan_out)
         if act:  # a constructed and flushed act
-            session.commit()
-            vc = len(act.versions)
+            vc = count_versions(act.id, session)
+            with metrics.stage("commit"):
+                session.commit()
+            metrics.inc("acts_total", result="new")
+            metrics.observe("act_seconds", time.time() - t1)
             print(
                 threading.current_thread().name,
                 "page",
                 page,
                 "act",
-                doc_meta.id,
+                code,
                 f"({vc} ver)",
                 f"[{time.time() - t1:.02f}s]",
             )
 
 
-def ingest_all(recreate: bool, start_page: int = 1, max_workers: int = 2):
-    init_db(recreate=recreate)
-    docs_iterable = iterate_documents(start_page, per_page=100)
+def walk_listing(
+    start_page: int,
+    prefetch: int,
+    stop: threading.Event,
+    lock: frontier.ListingLock,
+):
+    """Record the search listing into the crawl frontier, then let `lock` go."""
+    crawler = SearchCrawler(start_page, per_page=100, prefetch=prefetch)
+    metrics.registry.gauge_function("crawler_queue_depth", lambda: crawler.queue_depth)
+    try:
+        page, codes = start_page, []
+        for doc_page, doc_meta in crawler:
+            if stop.is_set():
+                return
+            if doc_page != page:
+                frontier.record_page(page, crawler.page_count, codes)
+                page, codes = doc_page, []
+            codes.append(doc_meta.id)
+        frontier.record_page(page, crawler.page_count, codes)
+        frontier.finish_listing()
+        print("No more documents to list")
+    finally:
+        metrics.registry.remove_function("crawler_queue_depth")
+        crawler.close()
+        lock.release()
+
+
+def ingest_worker(fan_out: int, incremental: bool, stop: threading.Event):
+    """Ingest acts claimed from the frontier until no work is left or `stop` is set."""
+    while not stop.is_set():
+        claimed = frontier.claim()
+        if claimed is None:
+            if frontier.drained():
+                return
+            stop.wait(POLL_INTERVAL)  # for the listing, or for a retry to be due
+            continue
+
+        code, page = claimed
+        try:
+            with metrics.busy("workers_busy"):
+                process_doc(page, code, fan_out, incremental)
+        except Exception as e:
+            print(f"Worker failed on {code}: {e}")
+            metrics.inc("acts_total", result="failed")
+            frontier.fail(code, e)
+        else:
+            frontier.finish(code)
+
+
+def print_frontier():
+    counts = frontier.summary()
+    print("Frontier:", ", ".join(f"{state.value} {n}" for state, n in counts.items()))
+
+
+def ingest_all(
+    recreate: bool,
+    start_page: int | None = None,
+    max_workers: int = 2,
+    fan_out: int = DEFAULT_FAN_OUT,
+    prefetch: int = DEFAULT_PREFETCH,
+    incremental: bool = False,
+    memory_budget: int = DEFAULT_LIMIT,
+):
+    """
+    Ingest all listed acts through the crawl frontier.
+
+    The listing is walked in its own thread while `max_workers` threads ingest
+    the acts it has recorded. An interrupted run resumes where it stopped,
+    `start_page` walks the listing from that page instead.
 
-    futures = set()
-    stop_consuming = False
+    Any number of processes can run it at once against the same database, the
+    first one walks the listing and all of them take acts from the frontier.
+    """
+    budget.limit = memory_budget
+    if models.pool_size is None:
+        models.configure(size=max_workers + EXTRA_CONNECTIONS)
+    init_db(recreate=recreate)
+    models.prewarm()
+    # counting the frontier takes a query, it is sampled rarely
+    metrics.registry.gauge_function(
+        "frontier_acts", frontier.summary, label="state", every=30
+    )
+    metrics.registry.gauge_function("budget_bytes", lambda: budget.used)
+    metrics.registry.gauge_function("db_connections_in_use", models.connections_in_use)
+    lock, listing_page = frontier.join_crawl(start_page, incremental)
+    stop = threading.Event()
+    alive = threading.Event()
+    threading.Thread(
+        target=frontier.keep_alive, args=(alive,), name="heartbeat", daemon=True
+    ).start()
     interrupted = False
 
     with ThreadPoolExecutor(
-        max_workers=max_workers, thread_name_prefix="thread"
+        max_workers=max_workers + 1, thread_name_prefix="thread"
     ) as executor:
-
-        def submit_next():
-            page, doc_meta = next(docs_iterable)
-            return executor.submit(process_doc, page, doc_meta)
+        listing = None
+        if lock is not None:
+            listing = executor.submit(walk_listing, listing_page, prefetch, stop, lock)
+        workers = [
+            executor.submit(ingest_worker, fan_out, incremental, stop)
+            for _ in range(max_workers)
+        ]
 
         try:
-            # Prime pool
-            for _ in range(max_workers):
-                futures.add(submit_next())
-
-            # Rolling saturation
-            while futures:
-                done, futures = wait(futures, return_when=FIRST_COMPLETED)
-
-                for future in done:
-                    try:
-                        future.result()  # surface worker errors
-                    except Exception as e:
-                        print(f"Worker failed: {e}")
-                        stop_consuming = True
-
-                    # Only refill if no failure occurred
-                    if not stop_consuming:
-                        futures.add(submit_next())
-
-                # If failure happened, stop refilling entirely
-                if stop_consuming:
-                    break
-
+            wait(workers)
         except KeyboardInterrupt:
             print("\nCtrl+C received. Stopping submission...")
             interrupted = True
-        except StopIteration:
-            print("No more documents to ingest")
-        except Exception as e:
-            print("Error running ingestion loop:", e)
-
-        if futures:
+            stop.set()
             print("Waiting for running tasks to finish...")
-            wait(futures)
+            wait(workers)
+
+        for future in [listing, *workers]:
+            if future is not None and future.exception():
+                print("Error running ingestion loop:", future.exception())
 
-        print("All running tasks are finished")
-        if interrupted:
-            print("Exited due to user interrupt")
+    alive.set()
+    print("All running tasks are finished")
+    print_frontier()
+    if interrupted:
+        print("Exited due to user interrupt")
@@ -0,0 +1,60 @@
+"""Linking of act versions to the acts that caused them.
+
+Ingest stores the code of a cause act as `act_version.cause_act_code`, the cause
+act may not be ingested yet at that time. `link_causes` resolves the codes to
+`cause_act_id` afterwards with set-based updates over ranges of version ids.
+Only unresolved rows are in the partial index it walks, so a rerun only looks
+at versions whose cause act was still missing.
+"""
+
+from typing import Iterator
+
+from sqlalchemy import text
+
+from .models import get_engine
+
+UNRESOLVED_RANGE = text(
+    "SELECT min(id), max(id) FROM act_version "
+    "WHERE cause_act_id IS NULL AND cause_act_code IS NOT NULL"
+)
+
+LINK_BATCH = text(
+    """
+    UPDATE act_version AS av SET cause_act_id = a.id
+    FROM act AS a
+    WHERE a.code = av.cause_act_code
+      AND av.cause_act_id IS NULL AND av.cause_act_code IS NOT NULL
+      AND av.id >= :lo AND av.id < :hi
+    """
+)
+
+COUNT_UNRESOLVED = text(
+    "SELECT count(*) FROM act_version "
+    "WHERE cause_act_id IS NULL AND cause_act_code IS NOT NULL"
+)
+
+
+def link_causes(batch_size: int = 50_000) -> Iterator[tuple[int, int]]:
+    """
+    Fill in `cause_act_id` from `cause_act_code`, an id range per transaction.
+
+    Yields the number of versions linked by each batch and the last id it covered.
+    """
+    with get_engine().connect() as conn:
+        lo, hi = conn.execute(UNRESOLVED_RANGE).one()
+    if lo is None:
+        return
+
+    while lo <= hi:
+        with get_engine().begin() as conn:
+            linked = conn.execute(
+                LINK_BATCH, {"lo": lo, "hi": lo + batch_size}
+            ).rowcount
+        yield linked, min(lo + batch_size - 1, hi)
+        lo += batch_size
+
+
+def count_unresolved() -> int:
+    """Versions with a cause act code that matches no ingested act."""
+    with get_engine().connect() as conn:
+        return conn.execute(COUNT_UNRESOLVED).scalar()
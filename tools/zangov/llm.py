@@ -1,23 +1,39 @@
-from pydantic_ai.providers.openai import OpenAIProvider
-from pydantic_ai.models.openai import OpenAIResponsesModel
-from marvin import Agent
+"""LLM agents, built on first use: marvin and pydantic_ai are slow to import."""
 
-lmstudio_provider = OpenAIProvider(base_url="http://localhost:1234/v1/")
+from functools import cache
 
+LMSTUDIO_URL = "http://localhost:1234/v1/"
+MODEL_NAME = "openai/gpt-oss-20b"
 
-gpt_oss_model = OpenAIResponsesModel(
-    "openai/gpt-oss-20b",
-    provider=lmstudio_provider
-)
 
+@cache
+def get_lmstudio_provider():
+    from pydantic_ai.providers.openai import OpenAIProvider
 
-mark_downer = Agent(
-    name="Mark Downer",
-    description=(
-        "Converts structured legal HTML documents into normalized "
-        "GitHub Flavored Markdown while preserving the original text content."
-    ),
-    instructions="""Convert the provided HTML document into GitHub Flavored Markdown (GFM).
+    return OpenAIProvider(base_url=LMSTUDIO_URL)
+
+
+@cache
+def get_gpt_oss_model():
+    from pydantic_ai.models.openai import OpenAIResponsesModel
+
+    return OpenAIResponsesModel(
+        MODEL_NAME,
+        provider=get_lmstudio_provider()
+    )
+
+
+@cache
+def get_mark_downer():
+    from marvin import Agent
+
+    return Agent(
+        name="Mark Downer",
+        description=(
+            "Converts structured legal HTML documents into normalized "
+            "GitHub Flavored Markdown while preserving the original text content."
+        ),
+        instructions="""Convert the provided HTML document into GitHub Flavored Markdown (GFM).
         
         Preserve the original text exactly.
         Maintain document hierarchy (titles, sections, articles, numbered points, notes).
@@ -26,5 +42,17 @@ mark_downer = Agent(
         
         Output only Markdown.
         """,
-    model=gpt_oss_model
-)
+        model=get_gpt_oss_model()
+    )
+
+
+def __getattr__(name: str):
+    # `llm.mark_downer` and the others still work, built when first asked for
+    getters = {
+        "lmstudio_provider": get_lmstudio_provider,
+        "gpt_oss_model": get_gpt_oss_model,
+        "mark_downer": get_mark_downer,
+    }
+    if name in getters:
+        return getters[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
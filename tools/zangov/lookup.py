@@ -0,0 +1,162 @@
+"""Point-in-time lookup of acts: what an act said on a date, in a language.
+
+The version in force is the latest one with `date <= day`, found with an index
+only scan of `ix_act_version_as_of`. Decoded versions are kept in a size-capped
+LRU, and rendered to Markdown once asked for; versions never change once
+stored, so they stay valid.
+Resolved lookups are kept for `RESOLVE_TTL` seconds, as a new version may
+change the answer for a date.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import cached_property
+
+from sqlmodel import Session, select
+
+from . import storage
+from .enums import Language
+from .md import content_to_md
+from .models import Act, ActVersion, get_engine
+
+DEFAULT_MAX_BYTES = 256 * 1024**2
+RESOLVE_TTL = 60.0
+
+
+class Snapshot:
+    """An act version as of a date, decoded, rendered when first asked for."""
+
+    def __init__(
+        self,
+        code: str,
+        version: ActVersion,
+        content: list[dict],
+        content_size: int,
+    ):
+        self.code = code
+        self.version_id = version.id
+        self.language = version.language
+        self.date = version.date
+        self.is_actual = version.is_actual
+        self.cause_act_code = version.cause_act_code
+        self.content = content
+        # the JSON length and as much for the Markdown, which is shorter, decoded
+        # elements take a few times more
+        self.size = 2 * content_size
+
+    @cached_property
+    def markdown(self) -> str:
+        return content_to_md(self.content)
+
+
+class SnapshotCache:
+    """Size-capped LRU of snapshots by version id, safe to share between threads."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = RESOLVE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = self.misses = 0
+
+        self._lock = threading.Lock()
+        self._snapshots: OrderedDict[int, Snapshot] = OrderedDict()  # oldest first
+        self._total = 0
+        # (code, language, day) -> (version id, resolved at)
+        self._resolved: dict[tuple[str, Language, date], tuple[int, float]] = {}
+
+    def resolved(self, key: tuple[str, Language, date]) -> int | None:
+        with self._lock:
+            entry = self._resolved.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def resolve(self, key: tuple[str, Language, date], version_id: int):
+        with self._lock:
+            if len(self._resolved) > 100_000:
+                self._resolved.clear()  # entries are tiny, cheaper than tracking age
+            self._resolved[key] = version_id, time.monotonic()
+
+    def get(self, version_id: int) -> Snapshot | None:
+        with self._lock:
+            snapshot = self._snapshots.get(version_id)
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self._snapshots.move_to_end(version_id)
+            self.hits += 1
+            return snapshot
+
+    def put(self, snapshot: Snapshot):
+        with self._lock:
+            old = self._snapshots.pop(snapshot.version_id, None)
+            if old is not None:
+                self._total -= old.size
+            self._snapshots[snapshot.version_id] = snapshot
+            self._total += snapshot.size
+            while self._total > self.max_bytes and len(self._snapshots) > 1:
+                _, evicted = self._snapshots.popitem(last=False)
+                self._total -= evicted.size
+
+
+cache = SnapshotCache()
+
+
+def configure(max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = RESOLVE_TTL):
+    """Replace the snapshot cache with one of another size."""
+    global cache
+    cache = SnapshotCache(max_bytes, ttl)
+
+
+def find_version(s: Session, code: str, language: Language, day: date) -> int | None:
+    """Id of the version of an act in force at `day`."""
+    return s.exec(
+        select(ActVersion.id)
+        .join(Act, Act.id == ActVersion.act_id)
+        .where(
+            Act.code == code,
+            ActVersion.language == language,
+            ActVersion.date <= day,
+        )
+        .order_by(ActVersion.date.desc())
+        .limit(1)
+    ).first()
+
+
+def load_snapshot(s: Session, code: str, version_id: int) -> Snapshot:
+    av = s.get(ActVersion, version_id)
+    stored = storage.content_json(av)
+    if stored is not None:
+        content = json.loads(stored)
+    else:
+        content = storage.load_content(s, av)
+        stored = json.dumps(content, ensure_ascii=False)
+    return Snapshot(code, av, content, len(stored))
+
+
+def as_of(code: str, language: Language, day: date | None = None) -> Snapshot | None:
+    """
+    The act `code` in `language` as it was on `day`, today by default.
+
+    Returns None when the act has no version by that date.
+    """
+    language = Language(language)
+    key = code, language, day or date.today()
+    version_id = cache.resolved(key)
+    if version_id is not None:
+        snapshot = cache.get(version_id)
+        if snapshot is not None:
+            return snapshot
+
+    with Session(get_engine()) as s:
+        version_id = find_version(s, *key)
+        if version_id is None:
+            return None
+        cache.resolve(key, version_id)
+        snapshot = cache.get(version_id)
+        if snapshot is None:
+            snapshot = load_snapshot(s, code, version_id)
+            cache.put(snapshot)
+    return snapshot
@@ -0,0 +1,152 @@
+"""Manifest of exported act versions, for exports that only write what changed.
+
+The manifest records the content hash and the output path of every exported
+version by its key, (act id, date, language). The versions in the database and
+the manifest entries are both read in key order and merged, so an export finds
+new, changed and stale versions in one pass without holding either side in
+memory.
+
+The manifest is a sqlite file kept with the export, removing the export removes
+its manifest too.
+"""
+
+import sqlite3
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from sqlmodel import Session, select
+
+from .models import ActVersion
+
+# act id, ISO date, language code
+Key = tuple[int, str, str]
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS exported (
+    act_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    language TEXT NOT NULL,
+    content_hash TEXT,
+    path TEXT NOT NULL,
+    PRIMARY KEY (act_id, date, language)
+) WITHOUT ROWID
+"""
+
+
+class Manifest:
+    """
+    Exported versions by key with their content hash and output path.
+
+        with Manifest(out / MANIFEST_NAME) as manifest:
+            for key, content_hash, path in manifest.entries():
+                ...
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        # entries are read on another connection while they are changed
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(CREATE_TABLE)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def entries(self) -> Iterator[tuple[Key, str | None, str]]:
+        """(key, content hash, path) of every entry in key order, as committed."""
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute(
+                "SELECT act_id, date, language, content_hash, path FROM exported "
+                "ORDER BY act_id, date, language"
+            )
+            for act_id, day, language, content_hash, path in rows:
+                yield (act_id, day, language), content_hash, path
+        finally:
+            conn.close()
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM exported LIMIT 1").fetchone() is None
+
+    def put(self, key: Key, content_hash: str | None, path: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO exported VALUES (?, ?, ?, ?, ?)",
+            (*key, content_hash, path),
+        )
+
+    def remove(self, key: Key):
+        self.conn.execute(
+            "DELETE FROM exported WHERE act_id = ? AND date = ? AND language = ?", key
+        )
+
+    def clear(self):
+        self.conn.execute("DELETE FROM exported")
+
+    def latest(self, act_id: int, language: str) -> str | None:
+        """Date of the latest exported version of an act in a language."""
+        return self.conn.execute(
+            "SELECT max(date) FROM exported WHERE act_id = ? AND language = ?",
+            (act_id, language),
+        ).fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+
+
+def version_keys(
+    s: Session, batch_size: int = 10_000
+) -> Iterator[tuple[Key, int, str | None]]:
+    """(key, version id, content hash) of every act version in key order."""
+    rows = s.exec(
+        select(
+            ActVersion.act_id,
+            ActVersion.date,
+            ActVersion.language,
+            ActVersion.id,
+            ActVersion.content_hash,
+        )
+        # the same order as sqlite's, whatever the database collation
+        .order_by(ActVersion.act_id, ActVersion.date, ActVersion.language.collate("C"))
+        .execution_options(yield_per=batch_size)
+    )
+    for act_id, day, language, version_id, content_hash in rows:
+        yield (act_id, day.isoformat(), language.value), version_id, content_hash
+
+
+def diff(
+    versions: Iterable[tuple[Key, int, str | None]],
+    entries: Iterable[tuple[Key, str | None, str]],
+    path_of: Callable[[Key], str],
+) -> Iterator[tuple[Key, int | None, str | None, str | None]]:
+    """
+    Merge the versions with the manifest entries, both in key order.
+
+    Yields (key, version id, content hash, old path) of the versions to write,
+    the old path is None for a new version. Yields (key, None, None, path) of the
+    stale entries, whose versions are gone. A version without a content hash is
+    always written.
+    """
+    entries = iter(entries)
+    entry = next(entries, None)
+    for key, version_id, content_hash in versions:
+        while entry is not None and entry[0] < key:
+            yield entry[0], None, None, entry[2]
+            entry = next(entries, None)
+        if entry is None or entry[0] != key:
+            yield key, version_id, content_hash, None
+            continue
+        _, old_hash, old_path = entry
+        entry = next(entries, None)
+        if content_hash is None or content_hash != old_hash or old_path != path_of(key):
+            yield key, version_id, content_hash, old_path
+    while entry is not None:
+        yield entry[0], None, None, entry[2]
+        entry = next(entries, None)
@@ -1,4 +1,3 @@
-import re
 from pathlib import Path
 
 from .schemas import Document, ContentElement
@@ -22,39 +21,46 @@ from markdownify import markdownify
 #             root.h1(e.text)
 
 
+def normalize_text(t: str) -> str:
+    """Replace line breaks and runs of whitespace with single spaces, strip the ends."""
+    return " ".join(t.split())
+
+
 def element_to_md(cel: ContentElement) -> list[str]:
+    return text_to_md(cel.text, cel.type, cel.level)
+
+
+def text_to_md(text: str | None, type_: ContentType | str, level: int) -> list[str]:
+    """Markdown lines of an element, `type_` can be a raw value of an element dict."""
     lines = []
-    t = cel.text
 
-    if not t:
+    if not text:
         return lines
 
     # element text is not empty
-    t = t.replace("\n", " ")  # clear line breaks
-    t = re.sub(r"\s+", " ", t)  # clear extra whitespace
-    t = t.strip()  # clear leading/trailing whitespace
+    t = normalize_text(text)
 
     # level 1: DOC, content root
     # level 2: HEADING
     # level 3: SUBHEADING
 
-    if cel.type == ContentType.TITLE:
+    if type_ == ContentType.TITLE:
         lines = ["", f"# {t}", ""]
-    elif cel.type == ContentType.HEADING:
-        if cel.level == 2:
+    elif type_ == ContentType.HEADING:
+        if level == 2:
             lines = ["", f"# {t}", ""]  # let's try same as heading
-        elif cel.level == 3:
+        elif level == 3:
             lines = ["", f"## {t}", ""]
-        elif cel.level >= 4:
+        elif level >= 4:
             lines = ["", f"### {t}", ""]
         else:
-            raise ValueError(f"Unhandled heading level: {cel.level}")
-    elif cel.type == ContentType.TEXT:
+            raise ValueError(f"Unhandled heading level: {level}")
+    elif type_ == ContentType.TEXT:
         lines = [t, ""]
-    elif cel.type == ContentType.NOTE:
+    elif type_ == ContentType.NOTE:
         lines = [f"**{t}**", ""]
     else:
-        lines = [f"**{cel.type.name}:** {t}", ""]
+        lines = [f"**{ContentType(type_).name}:** {t}", ""]
         # raise ValueError(f"Unhandled content type: {cel.type}")
         # highlight other text with strikethrough
         # lines = [f"~~{t}~~", ""]
@@ -62,13 +68,21 @@ def element_to_md(cel: ContentElement) -> list[str]:
     return lines
 
 
-def document_to_md(doc: Document) -> str:
+def content_to_md(content: list[dict | ContentElement]) -> str:
     lines = []
-    for el in doc.content:
-        lines.extend(element_to_md(el))
+    for el in content:
+        if isinstance(el, dict):
+            # no model for every element, the raw values render the same
+            lines.extend(text_to_md(el.get("text"), el["type"], el["level"]))
+        else:
+            lines.extend(element_to_md(el))
     return "\n".join(lines)
 
 
+def document_to_md(doc: Document) -> str:
+    return content_to_md(doc.content)
+
+
 def doc_to_file(doc: Document, folder: str | Path) -> None:
     path = Path(folder) / f"{doc.code}_{doc.language}_{doc.version_date.strftime("%Y%m%d")}.md"
     with open(path, "w", encoding="utf-8") as f:
@@ -0,0 +1,102 @@
+"""Export of act versions into a tree of Markdown files.
+
+Every version is a file `<type>/<code>/<date>-<language>.md`. The tree keeps a
+`Manifest` of its files, so an export writes only the new and changed versions
+and removes the files of versions that are gone.
+"""
+
+from contextlib import suppress
+from functools import partial
+from itertools import batched
+from pathlib import Path
+from typing import Iterator
+
+from sqlmodel import Session, select
+
+from .gitexport import act_dirs
+from .manifest import Key, Manifest, diff, version_keys
+from .models import ActVersion, get_engine
+from .render import DEFAULT_CACHE_DIR, DEFER_CONTENT, MarkdownCache, Renderer
+
+MANIFEST_NAME = ".manifest.sqlite"
+
+
+def tree_path(dirs: dict[int, str], key: Key) -> str:
+    act_id, day, language = key
+    return f"{dirs[act_id]}/{day.replace('-', '')}-{language}.md"
+
+
+def remove_file(out: Path, path: str):
+    file = out / path
+    file.unlink(missing_ok=True)
+    with suppress(OSError):
+        file.parent.rmdir()  # once the act has no files left
+
+
+def export_md(
+    out: str | Path,
+    batch_size: int = 500,
+    processes: int | None = None,
+    cache_dir: str | Path | None = DEFAULT_CACHE_DIR,
+    full: bool = False,
+) -> Iterator[tuple[int, int]]:
+    """
+    Bring the Markdown tree at `out` up to date with the database.
+
+    With `full` the files of the manifest are removed and every version is
+    written again. Versions are rendered by `processes` processes, through a
+    Markdown cache in `cache_dir` unless it is None. The manifest is committed
+    after every batch, so an interrupted export goes on where it stopped.
+
+    Yields the numbers of files written and removed by each batch.
+    """
+    out = Path(out)
+    cache = MarkdownCache(cache_dir) if cache_dir is not None else None
+    with (
+        Manifest(out / MANIFEST_NAME) as manifest,
+        Session(get_engine()) as s,
+        Renderer(processes, cache) as renderer,
+    ):
+        if full:
+            # an empty manifest has no stale entries, so the files of versions
+            # that are gone are removed here, the others are written again
+            for _, _, path in manifest.entries():
+                remove_file(out, path)
+            manifest.clear()
+            manifest.commit()
+        path_of = partial(tree_path, act_dirs(s))
+        changes = diff(version_keys(s), manifest.entries(), path_of)
+        for batch in batched(changes, batch_size):
+            removed = 0
+            todo = []
+            for key, version_id, content_hash, old_path in batch:
+                if version_id is None:
+                    remove_file(out, old_path)
+                    manifest.remove(key)
+                    removed += 1
+                else:
+                    todo.append((key, version_id, content_hash, old_path))
+
+            found = {
+                av.id: av
+                for av in s.exec(
+                    select(ActVersion)
+                    .where(ActVersion.id.in_([t[1] for t in todo]))
+                    .options(*DEFER_CONTENT)
+                )
+            }
+            todo = [t for t in todo if t[1] in found]  # deleted meanwhile
+            versions = [found[t[1]] for t in todo]
+            for (key, _, content_hash, old_path), markdown in zip(
+                todo, renderer.render(s, versions)
+            ):
+                path = path_of(key)
+                file = out / path
+                file.parent.mkdir(parents=True, exist_ok=True)
+                file.write_text(markdown, encoding="utf-8")
+                if old_path is not None and old_path != path:
+                    remove_file(out, old_path)
+                manifest.put(key, content_hash, path)
+            s.expunge_all()
+            manifest.commit()
+            yield len(todo), removed
@@ -0,0 +1,488 @@
+"""Ingest instrumentation: request latencies, response sizes, stage timings.
+
+Everything is recorded in the process-wide `registry`, which any thread can
+update. Metrics are named and labelled the Prometheus way:
+
+- counters only go up, like `http_responses_total{endpoint, status}`;
+- gauges go up and down, like `workers_busy`, or are sampled from a function
+  when read, like the depth of the crawler queue;
+- histograms count observations in fixed buckets, like request latencies and
+  `stage_seconds{stage}`, the time spent in each stage of the ingest.
+
+Stages run in many threads at once, so their times add up to more than the
+wall clock. `Exporter` writes the metrics every few seconds as a Prometheus
+textfile, for the textfile collector of node_exporter, or as a JSON snapshot.
+"""
+
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Iterator
+
+import httpx
+
+PREFIX = "qaz_law_"
+
+# seconds, from a cached response to a huge document on a slow day
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# seconds between exports
+DEFAULT_INTERVAL = 15.0
+
+# request extension counting the attempts of a request, `RetryTransport` sends
+# the same request object again for every retry
+ATTEMPTS = "qaz_law_attempts"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """Counts of observations by bucket upper bound, with their sum."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate of a quantile, interpolated within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # beyond the last bound
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+def _label_value(value) -> str:
+    return str(value.value if isinstance(value, Enum) else value)
+
+
+class Registry:
+    """Metrics of the process by name and labels, safe to update from any thread."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._gauges: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], Histogram] = {}
+        # name -> (function, label, seconds between calls, last value, called at)
+        self._functions: dict[str, list] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple[str, Labels]:
+        return name, tuple(sorted((k, _label_value(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name: str, delta: float, **labels):
+        """Move a gauge by `delta`."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels,
+    ):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        with self._lock:
+            return self._histograms.get(self._key(name, labels))
+
+    def gauge_function(
+        self,
+        name: str,
+        fn: Callable[[], float | dict],
+        label: str | None = None,
+        every: float = 0.0,
+    ):
+        """
+        Sample a gauge from `fn` when the metrics are read.
+
+        With `label` the function returns the values by that label. A slow
+        function, like a database query, is called once per `every` seconds.
+        """
+        with self._lock:
+            self._functions[name] = [fn, label, every, None, 0.0]
+
+    def remove_function(self, name: str):
+        with self._lock:
+            self._functions.pop(name, None)
+
+    def _sample(self) -> dict[tuple[str, Labels], float]:
+        with self._lock:
+            functions = list(self._functions.items())
+        sampled = {}
+        now = time.monotonic()
+        for name, entry in functions:
+            fn, label, every, value, called_at = entry
+            if value is None or now - called_at >= every:
+                try:
+                    value = fn()
+                except Exception as e:
+                    print(f"Metric {name} failed: {e}")
+                    continue
+                entry[3:] = value, now
+            if label is None:
+                sampled[name, ()] = value
+            else:
+                for label_value, v in value.items():
+                    sampled[name, ((label, _label_value(label_value)),)] = v
+        return sampled
+
+    def collect(self) -> tuple[dict, dict, dict]:
+        """Copies of the counters, gauges and histograms."""
+        sampled = self._sample()
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = {**self._gauges, **sampled}
+            histograms = {}
+            for key, h in self._histograms.items():
+                copy = histograms[key] = Histogram(h.buckets)
+                copy.counts, copy.count, copy.sum = list(h.counts), h.count, h.sum
+        return counters, gauges, histograms
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._functions.clear()
+        self.started = time.time()
+
+    def snapshot(self) -> dict:
+        """The metrics as plain JSON data, with histogram quantiles."""
+        counters, gauges, histograms = self.collect()
+
+        def entries(values: dict) -> list[dict]:
+            return [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(values.items())
+            ]
+
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "counters": entries(counters),
+            "gauges": entries(gauges),
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                }
+                for (name, labels), h in sorted(histograms.items())
+            ],
+        }
+
+    def prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        counters, gauges, histograms = self.collect()
+        lines = []
+
+        def family(values: dict, kind: str):
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    typed.add(name)
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {_number(value)}")
+
+        family(counters, "counter")
+        family(gauges, "gauge")
+        typed = set()
+        for (name, labels), h in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            bounds = [*map(_number, h.buckets), "+Inf"]
+            for bound, n in zip(bounds, h.counts):
+                cumulative += n
+                le = labels + (("le", bound),)
+                lines.append(f"{PREFIX}{name}_bucket{_labels(le)} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {_number(h.sum)}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+def inc(name: str, value: float = 1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block of work as the ingest stage `name`, failed or not."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("stage_seconds", time.perf_counter() - started, stage=name)
+
+
+@contextmanager
+def busy(name: str, **labels) -> Iterator[None]:
+    """Count a block of work in the gauge `name` while it runs."""
+    registry.add(name, 1, **labels)
+    try:
+        yield
+    finally:
+        registry.add(name, -1, **labels)
+
+
+_ENDPOINTS = (
+    ("search", re.compile(r"/documents/search$")),
+    ("versions", re.compile(r"/documents/[^/]+/[^/]+/versions$")),
+    ("version", re.compile(r"/documents/[^/]+/[^/]+/\d{2}\.\d{2}\.\d{4}$")),
+    ("latest", re.compile(r"/documents/[^/]+/[^/]+$")),
+)
+
+
+def endpoint(path: str) -> str:
+    """Name of the API endpoint of a URL path, for labels of a small cardinality."""
+    path = path.rstrip("/")
+    for name, pattern in _ENDPOINTS:
+        if pattern.search(path):
+            return name
+    return "other"
+
+
+class _CountingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Response body that records its size and download time once closed."""
+
+    def __init__(self, stream, endpoint: str):
+        self.stream = stream
+        self.endpoint = endpoint
+        self.size = 0
+        self.started = time.perf_counter()
+        self._recorded = False
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.size += len(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            yield chunk
+
+    def _record(self):
+        if not self._recorded:
+            self._recorded = True
+            registry.inc("http_response_bytes_total", self.size, endpoint=self.endpoint)
+            registry.observe(
+                "http_download_seconds",
+                time.perf_counter() - self.started,
+                endpoint=self.endpoint,
+            )
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._record()
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self._record()
+
+
+class InstrumentedTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Record every request attempt by endpoint, for sync and async clients.
+
+    Latency is measured up to the response headers, the body is timed and
+    counted on its own as it is read. Placed under the retry transport, it sees
+    every attempt of a request, and all but the first are counted in
+    `http_retries_total`.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport | httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    def _started(self, request: httpx.Request) -> tuple[str, float]:
+        name = endpoint(request.url.path)
+        attempts = request.extensions.get(ATTEMPTS, 0)
+        request.extensions[ATTEMPTS] = attempts + 1
+        if attempts:
+            registry.inc("http_retries_total", endpoint=name)
+        registry.add("http_requests_in_flight", 1)
+        return name, time.perf_counter()
+
+    def _finished(
+        self,
+        name: str,
+        started: float,
+        request: httpx.Request,
+        response: httpx.Response | None,
+        error: BaseException | None = None,
+    ) -> httpx.Response | None:
+        registry.add("http_requests_in_flight", -1)
+        registry.observe(
+            "http_request_seconds", time.perf_counter() - started, endpoint=name
+        )
+        if response is None:
+            if isinstance(error, Exception):  # not a cancellation
+                registry.inc(
+                    "http_errors_total", endpoint=name, error=type(error).__name__
+                )
+            return None
+        registry.inc("http_responses_total", endpoint=name, status=response.status_code)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_CountingStream(response.stream, name),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        name, started = self._started(request)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException as e:
+            self._finished(name, started, request, None, e)
+            raise
+        return self._finished(name, started, request, response)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        name, started = self._started(request)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException as e:  # cancelled requests leave the gauge too
+            self._finished(name, started, request, None, e)
+            raise
+        return self._finished(name, started, request, response)
+
+    def close(self):
+        self.transport.close()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def write(path: Path):
+    """
+    Write the metrics to `path` atomically, in the Prometheus text format for a
+    `.prom` file and as a JSON snapshot otherwise.
+    """
+    path = Path(path)
+    if path.suffix == ".prom":
+        data = registry.prometheus()
+    else:
+        data = json.dumps(registry.snapshot(), indent=1)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(data, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class Exporter:
+    """Write the metrics to a file every `interval` seconds, and once when stopped."""
+
+    def __init__(self, path: Path, interval: float = DEFAULT_INTERVAL):
+        self.path = Path(path)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write(self.path)
+            except OSError as e:
+                print(f"Metrics not written to {self.path}: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        write(self.path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
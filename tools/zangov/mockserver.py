@@ -0,0 +1,391 @@
+"""Local stand-in for the zan.gov.kz API, for benchmarks and offline runs.
+
+Serves the endpoints `client` uses under `/api`: the search listing, documents
+by language and version date, and version listings. Act "1" is the fixture of
+`examples`, every other act is synthetic. A synthetic act is generated on
+request from its code, with `versions` versions of `pages` pages of `elements`
+elements, and a share of its elements changes from version to version.
+
+Responses can be delayed and fail at random, `/_stats` tells the requests and
+bytes served so far.
+"""
+
+import copy
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+from pathlib import Path
+from typing import Any
+
+from .enums import ActTypeEnum
+
+EXAMPLES_DIR = Path(__file__).parent / "examples"
+FIXTURE_CODE = "1"
+# codes of synthetic acts start here, far from the fixture
+SYNTHETIC_BASE = 1_000_000
+
+_JSON_BLOCK = re.compile(r"```json\n(.*?)\n```", re.S)
+_ELLIPSIS = re.compile(r",\s*\{\.\.\.\}")  # elided list items of the examples
+
+_DOCUMENT = re.compile(
+    r"^/api/documents/(?P<code>[^/]+)/(?P<language>rus|kaz)"
+    r"(?:/(?P<date>\d{2}\.\d{2}\.\d{4}))?/?$"
+)
+_VERSIONS = re.compile(
+    r"^/api/documents/(?P<code>[^/]+)/(?P<language>rus|kaz)/versions$"
+)
+
+WORDS = (
+    "закон статья пункт республика казахстан право государство гражданин орган "
+    "порядок случай норма решение суд срок лицо имущество договор ответственность "
+    "заң бап тармақ республикасы қазақстан құқық мемлекет азамат орган тәртіп"
+).split()
+
+
+def load_example(name: str) -> Any:
+    """The response JSON of an example in `examples`."""
+    text = (EXAMPLES_DIR / name).read_text(encoding="utf-8")
+    return json.loads(_ELLIPSIS.sub("", _JSON_BLOCK.search(text).group(1)))
+
+
+class Corpus:
+    """The acts served by the mock, synthetic ones are generated from their code."""
+
+    def __init__(
+        self,
+        acts: int = 100,
+        versions: int = 5,
+        pages: int = 2,
+        elements: int = 200,
+        words: int = 12,
+        change_share: float = 0.05,
+        kaz_share: float = 0.5,
+        seed: int = 0,
+    ):
+        self.versions_count = versions
+        self.pages = pages
+        self.elements = elements
+        self.words = words
+        self.change_share = change_share
+        self.kaz_share = kaz_share
+        self.seed = seed
+
+        self.document_template = load_example("get-document.md")
+        self.versions_template = load_example("get-document-versions.md")
+        self.codes = [FIXTURE_CODE] + [
+            str(SYNTHETIC_BASE + i) for i in range(max(acts - 1, 0))
+        ]
+        self._synthetic = set(self.codes[1:])
+
+    def _random(self, *parts) -> random.Random:
+        return random.Random(":".join(map(str, (self.seed, *parts))))
+
+    def languages(self, code: str) -> tuple[str, ...]:
+        if code == FIXTURE_CODE or self._random(code, "kaz").random() < self.kaz_share:
+            return "rus", "kaz"
+        return ("rus",)
+
+    def version_dates(self, code: str) -> list[date]:
+        rnd = self._random(code, "dates")
+        day = date(2000, 1, 1) + timedelta(days=int(code) % 3650)
+        dates = []
+        for _ in range(self.versions_count):
+            dates.append(day)
+            day += timedelta(days=rnd.randint(30, 400))
+        return dates
+
+    def _metadata(self, code: str) -> dict:
+        metadata = copy.deepcopy(self.document_template["metadata"])
+        rnd = self._random(code, "metadata")
+        metadata["title"] = {"rus": f"Акт {code}", "kaz": f"{code} акті"}
+        metadata["requisites"] = {
+            "rus": f"Реквизиты {code}",
+            "kaz": f"{code} деректемелері",
+        }
+        metadata["stateAgencyApprovalDate"] = self.version_dates(code)[0].isoformat()
+        metadata["registryNumber"] = code
+        metadata["actTypes"] = [rnd.choice(list(ActTypeEnum)).value]
+        return metadata
+
+    def _cause(self, code: str, v: int) -> dict | None:
+        if v == 0:
+            return None
+        cause = self._random(code, "cause", v).choice(self.codes)
+        return {
+            "code": cause,
+            "document": cause,
+            "title": {"rus": f"Акт {cause}", "kaz": f"{cause} акті"},
+            "requisites": {"rus": f"Реквизиты {cause}", "kaz": ""},
+        }
+
+    def _changed(self, code: str, j: int, v: int) -> bool:
+        return (
+            zlib.crc32(f"{code}:{j}:{v}".encode()) % 10_000 < self.change_share * 10_000
+        )
+
+    def _element(self, code: str, language: str, j: int, v: int) -> dict:
+        last = next((w for w in range(v, 0, -1) if self._changed(code, j, w)), 0)
+        rnd = self._random(code, language, j, last)
+        el = {
+            "id": f"{code}{j:06d}",
+            "type": "doc"
+            if j == 0
+            else rnd.choice(("text", "text", "text", "article")),
+            "level": 1 if j == 0 else 2,
+            "text": " ".join(rnd.choices(WORDS, k=self.words)),
+            "properties": [],
+        }
+        if last:
+            el["changeId"] = str(last)
+        return el
+
+    def listing(self, page: int, limit: int) -> dict:
+        found = len(self.codes)
+        documents = []
+        for code in self.codes[(page - 1) * limit : page * limit]:
+            metadata = (
+                self.document_template["metadata"]
+                if code == FIXTURE_CODE
+                else self._metadata(code)
+            )
+            documents.append(
+                {
+                    "id": code,
+                    "code": code,
+                    "actTypes": metadata["actTypes"],
+                    "approvalPlace": metadata.get("approvalPlace", ""),
+                    "requisites": metadata["requisites"],
+                    "status": "new",
+                    "stateAgencyApprovalDate": metadata["stateAgencyApprovalDate"],
+                    "summary": {"rus": "", "kaz": ""},
+                }
+            )
+        return {
+            "page": page,
+            "pageCount": max(ceil(found / limit), 1),
+            "documentsFound": found,
+            "list": documents,
+        }
+
+    def versions(self, code: str, language: str) -> list | None:
+        if code not in self._synthetic and code != FIXTURE_CODE:
+            return None
+        if language not in self.languages(code):
+            return None
+        if code == FIXTURE_CODE:
+            return [{**v, "language": language} for v in self.versions_template]
+        metadata = self._metadata(code)
+        return [
+            {
+                "id": f"{code}_{v}",
+                "language": language,
+                "versionDate": day.isoformat(),
+                "metadata": metadata,
+                "references": [],
+                "cause": self._cause(code, v),
+            }
+            for v, day in enumerate(self.version_dates(code))
+        ]
+
+    def document(
+        self, code: str, language: str, day: date | None, page: int
+    ) -> dict | None:
+        listing = self.versions(code, language)
+        if listing is None:
+            return None
+        dates = [date.fromisoformat(v["versionDate"]) for v in listing]
+        v = (
+            len(dates) - 1
+            if day is None
+            else next((i for i, d in enumerate(dates) if d == day), None)
+        )
+        if v is None:
+            return None
+
+        doc = {
+            k: val
+            for k, val in self.document_template.items()
+            if k not in ("content", "index")
+        }
+        doc["version"] = copy.deepcopy(self.document_template["version"])
+        doc["version"].update(
+            id=listing[v]["id"],
+            language=language,
+            versionDate=listing[v]["versionDate"],
+            cause=listing[v].get("cause"),
+        )
+        doc.update(
+            language=language,
+            versionDate=listing[v]["versionDate"],
+            actualVersion=v == len(dates) - 1,
+            versionsCount=len(dates),
+        )
+        if code == FIXTURE_CODE:
+            doc["content"] = self.document_template["content"]
+            return doc
+
+        doc.update(
+            id=code,
+            code=code,
+            ngr=f"S{code}_",
+            metadata=listing[v]["metadata"],
+            pagesCount=self.pages,
+        )
+        doc["version"]["metadata"] = listing[v]["metadata"]
+        start = (page - 1) * self.elements
+        doc["content"] = [
+            self._element(code, language, j, v)
+            for j in range(start, start + self.elements)
+        ]
+        return doc
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server: "MockServer"
+    protocol_version = "HTTP/1.1"  # keep connections alive like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b""):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(status, len(body))
+
+    def _fail(self) -> bool:
+        """Delay the response and decide whether it fails."""
+        server = self.server
+        if server.latency:
+            time.sleep(
+                server.latency * random.uniform(1 - server.jitter, 1 + server.jitter)
+            )
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(503)
+            return True
+        return False
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/_stats":
+            body = json.dumps(self.server.stats()).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self._fail():
+            return
+
+        if m := _VERSIONS.match(path):
+            listing = self.server.corpus.versions(m["code"], m["language"])
+            self._reply(listing)
+        elif m := _DOCUMENT.match(path):
+            params = dict(p.partition("=")[::2] for p in query.split("&") if p)
+            day = (
+                datetime.strptime(m["date"], "%d.%m.%Y").date()
+                if m["date"] is not None
+                else None
+            )
+            self._reply(
+                self.server.document_body(
+                    m["code"], m["language"], day, int(params.get("page", 1))
+                )
+            )
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self._fail():
+            return
+        if self.path.partition("?")[0] != "/api/documents/search":
+            self._send(404)
+            return
+        page = self.server.corpus.listing(
+            payload.get("page", 1), payload.get("limit", 20)
+        )
+        self._reply(page)
+
+    def _reply(self, data: Any):
+        if data is None:
+            self._send(404)
+        elif isinstance(data, bytes):
+            self._send(200, data)
+        else:
+            self._send(200, json.dumps(data, ensure_ascii=False).encode())
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    The mock API on a local port, `url` is the base URL for `client.configure`.
+
+    `latency` seconds are added to every response, varied by `jitter`, and a
+    share `error_rate` of them fails with 503.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        corpus: Corpus,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.5,
+        error_rate: float = 0.0,
+    ):
+        super().__init__((host, port), MockHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+        self._lock = threading.Lock()
+        self._requests = self._errors = self._bytes = 0
+        # generated documents are reused by retries and by other languages' runs
+        self.document_body = lru_cache(maxsize=256)(self._document_body)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def _document_body(
+        self, code: str, language: str, day: date | None, page: int
+    ) -> bytes | None:
+        doc = self.corpus.document(code, language, day, page)
+        return None if doc is None else json.dumps(doc, ensure_ascii=False).encode()
+
+    def count(self, status: int, size: int):
+        with self._lock:
+            self._requests += 1
+            self._bytes += size
+            if status >= 500:
+                self._errors += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "errors": self._errors,
+                "bytes": self._bytes,
+            }
+
+    def start(self) -> threading.Thread:
+        """Serve in a daemon thread."""
+        thread = threading.Thread(
+            target=self.serve_forever, name="mockserver", daemon=True
+        )
+        thread.start()
+        return thread
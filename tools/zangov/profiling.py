@@ -0,0 +1,255 @@
+"""Profiling of a running ingest, with nothing but the standard library.
+
+`profile` runs cProfile and tracemalloc over a block. cProfile sees every
+thread since Python 3.12, but only one profiler can be active at a time, so
+threads are told apart by `Sampler` instead. It takes the stack of every
+thread a number of times per second, waiting included, and writes them in
+the folded format of flamegraph.pl and speedscope, under the thread name.
+
+Files written into the output directory:
+
+- `ingest.prof`, pstats data for snakeviz or `python -m pstats`;
+- `profile.txt`, the top functions by own and by cumulative time;
+- `allocations.txt`, the top allocating lines of the package when the most
+  memory was held, overall and under each function of `allocation_scopes`;
+- `stacks.folded`, sampled stacks of all threads, a line per stack and count;
+- `threads.folded`, the same by individual thread, not merged by pool.
+"""
+
+import cProfile
+import inspect
+import io
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Callable, Iterator
+
+DEFAULT_DIR = Path("profile")
+DEFAULT_RATE = 100  # samples per second
+
+# frames kept for every allocation, deep enough to reach the ingest functions
+# from pydantic and json internals
+TRACE_FRAMES = 32
+TOP = 40
+# seconds between allocation snapshots, the one holding the most memory is kept
+SNAPSHOT_INTERVAL = 30.0
+
+PACKAGE_DIR = str(Path(__file__).parent)
+
+# thread pools number their threads, "thread_3-fetch_12" is "thread-fetch"
+_THREAD_NUMBER = re.compile(r"_\d+")
+
+
+def allocation_scopes() -> dict[str, Callable]:
+    """Functions whose allocations are reported on their own, by name."""
+    from . import ingest_pg, md
+
+    return {
+        "construct_act": ingest_pg.construct_act,
+        "sync_act": ingest_pg.sync_act,
+        "fetch_page": ingest_pg.fetch_page,
+        "write_versions": ingest_pg.write_versions,
+        "document_to_md": md.document_to_md,
+    }
+
+
+class Sampler:
+    """Wall clock stack sampler of every thread of the process."""
+
+    def __init__(self, rate: float = DEFAULT_RATE):
+        self.interval = 1 / rate
+        self.samples = 0
+        self.stacks: Counter[tuple[str, str]] = Counter()  # (thread, stack)
+        self._labels: dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{Path(code.co_filename).stem}:{code.co_qualname}"
+            )
+        return label
+
+    def _stack(self, frame: FrameType | None) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != own:
+                self.stacks[names.get(ident, str(ident)), self._stack(frame)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self, merge_pools: bool = True) -> Iterator[str]:
+        """Lines of the folded format, the thread name is the root frame."""
+        merged: Counter[str] = Counter()
+        for (thread, stack), n in self.stacks.items():
+            if merge_pools:
+                thread = _THREAD_NUMBER.sub("", thread)
+            merged[f"{thread};{stack}"] += n
+        for stack, n in merged.most_common():
+            yield f"{stack} {n}"
+
+    def write(self, out: Path):
+        for name, merge in (("stacks.folded", True), ("threads.folded", False)):
+            (out / name).write_text(
+                "".join(line + "\n" for line in self.folded(merge)), encoding="utf-8"
+            )
+
+
+@contextmanager
+def sample(out: Path = DEFAULT_DIR, rate: float = DEFAULT_RATE) -> Iterator[Sampler]:
+    """Sample the stacks of all threads `rate` times per second within the block."""
+    out.mkdir(parents=True, exist_ok=True)
+    sampler = Sampler(rate)
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        sampler.write(out)
+        print(f"{sampler.samples} stack samples written to {out}")
+
+
+def _function_lines(fn: Callable) -> tuple[str, int, int]:
+    fn = inspect.unwrap(fn)
+    lines, first = inspect.getsourcelines(fn)
+    return inspect.getsourcefile(fn), first, first + len(lines) - 1
+
+
+class PeakSnapshot:
+    """Allocation snapshots taken regularly, the one holding the most is kept."""
+
+    def __init__(self, interval: float = SNAPSHOT_INTERVAL):
+        self.interval = interval
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self.held = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def take(self):
+        held, _ = tracemalloc.get_traced_memory()
+        if held > self.held:
+            self.snapshot, self.held = tracemalloc.take_snapshot(), held
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.take()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="snapshots", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.take()
+
+
+def top_allocations(
+    snapshot: tracemalloc.Snapshot,
+    held: int,
+    scopes: dict[str, Callable],
+    top: int = TOP,
+) -> str:
+    """Report of the lines that allocated the memory held in `snapshot`."""
+    out = io.StringIO()
+    _, peak = tracemalloc.get_traced_memory()
+    print(
+        f"Snapshot at {held / 1024**2:.1f} MB held, peak {peak / 1024**2:.1f} MB",
+        file=out,
+    )
+
+    # allocations made on behalf of the package, in pydantic or json too
+    ours = snapshot.filter_traces(
+        [tracemalloc.Filter(True, f"{PACKAGE_DIR}/*", all_frames=True)]
+    )
+    print(f"\nTop {top} lines under {PACKAGE_DIR}", file=out)
+    for stat in ours.statistics("lineno")[:top]:
+        print(stat, file=out)
+
+    for name, fn in scopes.items():
+        filename, first, last = _function_lines(fn)
+        sizes: Counter[tuple[str, int]] = Counter()
+        counts: Counter[tuple[str, int]] = Counter()
+        for trace in ours.traces:
+            if any(
+                f.filename == filename and first <= f.lineno <= last
+                for f in trace.traceback
+            ):
+                where = trace.traceback[-1]  # frames are oldest first
+                sizes[where.filename, where.lineno] += trace.size
+                counts[where.filename, where.lineno] += 1
+        total = sum(sizes.values())
+        print(
+            f"\n{name}: {total / 1024:.1f} KiB in {sum(counts.values())} blocks",
+            file=out,
+        )
+        for (filename, lineno), size in sizes.most_common(top // 4):
+            print(
+                f"{filename}:{lineno}: size={size / 1024:.1f} KiB, "
+                f"count={counts[filename, lineno]}",
+                file=out,
+            )
+    return out.getvalue()
+
+
+@contextmanager
+def profile(out: Path = DEFAULT_DIR) -> Iterator[cProfile.Profile]:
+    """
+    Profile the block with cProfile and trace its allocations with tracemalloc.
+
+    Both slow the ingest down a lot, the numbers are for comparing functions
+    with each other rather than for absolute timings.
+    """
+    out.mkdir(parents=True, exist_ok=True)
+    tracemalloc.start(TRACE_FRAMES)
+    snapshots = PeakSnapshot()
+    snapshots.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        snapshots.stop()
+        report = top_allocations(
+            snapshots.snapshot, snapshots.held, allocation_scopes()
+        )
+        tracemalloc.stop()
+
+        profiler.dump_stats(out / "ingest.prof")
+        text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=text)
+        for sort in (pstats.SortKey.TIME, pstats.SortKey.CUMULATIVE):
+            stats.sort_stats(sort).print_stats(TOP)
+        (out / "profile.txt").write_text(text.getvalue(), encoding="utf-8")
+        (out / "allocations.txt").write_text(report, encoding="utf-8")
+        print(f"Profile written to {out}")
@@ -0,0 +1,287 @@
+"""Adaptive rate limiting for the zan.gov.kz client.
+
+A token bucket paces requests, and the allowed rate and concurrency follow AIMD:
+they grow additively while the server answers quickly and are cut
+multiplicatively on 429/5xx responses, connect timeouts or rising latency.
+`Retry-After` pauses all requests until the server is ready again.
+"""
+
+import asyncio
+import email.utils
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import httpx
+
+# statuses that mean the server is overloaded
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+# failures that mean the same, others like read timeouts of huge documents,
+# cache misses or cancellation say nothing about the server's load
+THROTTLE_ERRORS = (httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a `Retry-After` header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except ValueError:
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class AdaptiveLimiter:
+    """
+    Token bucket with AIMD-controlled rate and concurrency, shared between threads.
+
+    Every request takes a token and a concurrency slot with `acquire` and returns
+    the slot with `release`, reporting its status and latency back. Coroutines
+    waiting in `acquire_async` are served in arrival order.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        min_rate: float = 0.5,
+        max_rate: float = 100.0,
+        concurrency: int = 8,
+        max_concurrency: int = 256,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+    ):
+        self._cond = threading.Condition()
+
+        self.rate = min(rate, max_rate)
+        self.min_rate = min_rate
+        self._max_rate = max_rate
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+
+        self.in_flight = 0
+        self.throttled = 0  # responses that made the limiter back off
+
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._slow_start = True
+        # latency EWMA, fast and slow, to tell a rising latency from a slow document
+        self._latency_fast: float | None = None
+        self._latency_slow: float | None = None
+
+        # [loop, future] of the coroutines waiting in `acquire_async`, in order
+        self._waiters: deque[list] = deque()
+
+    @property
+    def max_rate(self) -> float:
+        return self._max_rate
+
+    @max_rate.setter
+    def max_rate(self, max_rate: float):
+        # the current rate is an upper bound too, not only what the rate grows to
+        with self._cond:
+            self._max_rate = max_rate
+            self.rate = min(self.rate, max_rate)
+
+    def _refill(self, now: float):
+        burst = max(self.rate, 1.0)  # at most a second worth of tokens
+        self._tokens = min(burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _try_acquire(self) -> float:
+        """Take a slot and a token, or return the seconds to wait before a new try."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.concurrency):
+            return 0.05  # wait for a release
+        self._refill(now)
+        if self._tokens < 1.0:
+            return (1.0 - self._tokens) / self.rate
+        self._tokens -= 1.0
+        self.in_flight += 1
+        return 0.0
+
+    def acquire(self) -> float:
+        """Block until a request may be sent, return its start time."""
+        with self._cond:
+            while (wait := self._try_acquire()) > 0:
+                self._cond.wait(wait)
+        return time.monotonic()
+
+    def _wake_first(self):
+        """Tell the first waiting coroutine to try again, from any thread."""
+        if self._waiters:
+            loop, waiter = self._waiters[0]
+            loop.call_soon_threadsafe(_resolve, waiter)
+
+    async def acquire_async(self) -> float:
+        """
+        Wait until a request may be sent, return its start time.
+
+        Only the first waiting coroutine waits for a token, the end of a pause or
+        a slot freed by `release`, the others sleep until their turn comes.
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if not self._waiters and self._try_acquire() <= 0:
+                return time.monotonic()
+            entry = [loop, loop.create_future()]
+            self._waiters.append(entry)
+            if len(self._waiters) == 1:
+                self._wake_first()
+        try:
+            while True:
+                await entry[1]
+                with self._cond:
+                    wait = self._try_acquire()
+                    if wait <= 0:
+                        self._waiters.popleft()
+                        self._wake_first()
+                        return time.monotonic()
+                    if self.in_flight >= int(self.concurrency):
+                        entry[1] = loop.create_future()  # resolved by `release`
+                        continue
+                await asyncio.sleep(wait)  # for a token or the end of a pause
+        except BaseException:
+            with self._cond:
+                first = self._waiters[0] is entry
+                self._waiters.remove(entry)
+                if first:
+                    self._wake_first()
+            raise
+
+    def release(
+        self,
+        started: float,
+        status: int | None,
+        retry_after: float | None = None,
+        error: BaseException | None = None,
+    ):
+        """Return a slot, `status` is None for a request that failed with `error`."""
+        latency = time.monotonic() - started
+        with self._cond:
+            self.in_flight -= 1
+            if status in THROTTLE_STATUSES or isinstance(error, THROTTLE_ERRORS):
+                self.throttled += 1
+                if retry_after:
+                    self._paused_until = max(
+                        self._paused_until, time.monotonic() + retry_after
+                    )
+                self._decrease()
+            elif status is not None:
+                self._observe(latency)
+            self._cond.notify_all()
+            self._wake_first()
+
+    def _observe(self, latency: float):
+        if self._latency_fast is None:
+            self._latency_fast = self._latency_slow = latency
+        self._latency_fast += (latency - self._latency_fast) * 0.3
+        self._latency_slow += (latency - self._latency_slow) * 0.02
+
+        if self._latency_fast > self._latency_slow * self.latency_tolerance:
+            self._decrease()
+            return
+
+        # slots grow only while they are all taken, not to an unused limit
+        saturated = self.in_flight + 1 >= int(self.concurrency)
+        if self._slow_start:
+            # until the first back off, double about every second, like TCP slow start
+            self.rate = min(self.max_rate, self.rate + 1.0)
+            if saturated:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0)
+        else:
+            # additive increase: about +1 request/s and +1 slot per window of requests
+            self.rate = min(self.max_rate, self.rate + 1.0 / max(self.rate, 1.0))
+            if saturated:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1.0 / self.concurrency
+                )
+
+    def _decrease(self):
+        now = time.monotonic()
+        # responses to requests sent before the last cut do not cut again
+        if now - self._decreased_at < max(self._latency_slow or 0.0, 1.0):
+            return
+        self._decreased_at = now
+        self._slow_start = False
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.concurrency = max(1.0, self.concurrency * self.decrease_factor)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "rate": round(self.rate, 2),
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "paused": max(self._paused_until - time.monotonic(), 0.0),
+            }
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RateLimitedTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Send every request through an `AdaptiveLimiter`, for sync and async clients."""
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter,
+        transport: httpx.BaseTransport | httpx.AsyncBaseTransport,
+    ):
+        self.limiter = limiter
+        self.transport = transport
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> float | None:
+        return parse_retry_after(response.headers.get("Retry-After"))
+
+    # latency is measured up to the response headers, so the size of a document
+    # does not look like an overloaded server
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = self.limiter.acquire()
+        status = retry_after = error = None
+        try:
+            response = self.transport.handle_request(request)
+            status, retry_after = response.status_code, self._retry_after(response)
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(started, status, retry_after, error)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = await self.limiter.acquire_async()
+        status = retry_after = error = None
+        try:
+            response = await self.transport.handle_async_request(request)
+            status, retry_after = response.status_code, self._retry_after(response)
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(started, status, retry_after, error)
+
+    def close(self):
+        self.transport.close()
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,149 @@
+"""Batch rendering of act versions to Markdown.
+
+Contents are rendered in a process pool, as rendering is pure Python and would
+hold the GIL. The Markdown is cached on disk by content hash, a version whose
+content has been rendered before is neither loaded nor rendered again.
+"""
+
+import json
+import threading
+from compression import zstd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import defer, undefer
+from sqlmodel import Session, select
+
+from . import storage
+from .md import content_to_md
+from .models import ActVersion
+
+DEFAULT_CACHE_DIR = Path(".cache") / "markdown"
+# bump when md changes its output, so the cache is not used
+RENDER_VERSION = 1
+
+_CONTENT_COLUMNS = (
+    ActVersion.content,
+    ActVersion.content_zst,
+    ActVersion.element_hashes,
+)
+# query options for versions to render, content is loaded for cache misses only
+DEFER_CONTENT = tuple(defer(c) for c in _CONTENT_COLUMNS)
+
+
+class MarkdownCache:
+    """Rendered Markdown by content hash, one zstd file per content."""
+
+    def __init__(self, root: str | Path = DEFAULT_CACHE_DIR, level: int = 3):
+        self.root = Path(root) / f"v{RENDER_VERSION}"
+        self.level = level
+        self.hits = self.misses = 0
+
+    def _path(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / f"{content_hash}.md.zst"
+
+    def get(self, content_hash: str) -> str | None:
+        try:
+            data = self._path(content_hash).read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return zstd.decompress(data).decode()
+
+    def put(self, content_hash: str, markdown: str):
+        path = self._path(content_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(zstd.compress(markdown.encode(), level=self.level))
+        tmp.replace(path)  # atomic, readers never see a partial entry
+
+
+def load_content_columns(s: Session, versions: list[ActVersion]):
+    """Load deferred content columns of the versions with a single query."""
+    ids = [av.id for av in versions if "content" in inspect(av).unloaded]
+    if ids:
+        s.exec(
+            select(ActVersion)
+            .where(ActVersion.id.in_(ids))
+            .options(*(undefer(c) for c in _CONTENT_COLUMNS))
+            .execution_options(populate_existing=True)
+        ).all()
+
+
+def render_content(content: list[dict] | str) -> str:
+    """Markdown of a content, given as elements or as their JSON."""
+    if isinstance(content, str):
+        content = json.loads(content)  # parsed in the worker, not in the parent
+    return content_to_md(content)
+
+
+class Renderer:
+    """
+    Render batches of act versions in a process pool, with a Markdown cache.
+
+        with Renderer(processes=8) as renderer:
+            markdowns = renderer.render(s, versions)
+    """
+
+    def __init__(
+        self,
+        processes: int | None = None,
+        cache: MarkdownCache | None = None,
+        chunksize: int = 8,
+    ):
+        self.cache = cache
+        self.chunksize = chunksize
+        self._pool = ProcessPoolExecutor(processes) if processes != 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def render(self, s: Session, versions: list[ActVersion]) -> list[str]:
+        """Markdown of the versions, in their order."""
+        markdowns: list[str | None] = [None] * len(versions)
+        # versions to render, the same content is rendered once
+        missing: dict[str | int, list[int]] = {}
+        for i, av in enumerate(versions):
+            key = av.content_hash or i
+            if key in missing:
+                missing[key].append(i)
+                continue
+            if self.cache is not None and av.content_hash:
+                markdowns[i] = self.cache.get(av.content_hash)
+            if markdowns[i] is None:
+                missing[key] = [i]
+        if not missing:
+            return markdowns
+
+        todo = [versions[indexes[0]] for indexes in missing.values()]
+        load_content_columns(s, todo)
+        # whole JSON goes to the workers as a string, cheaper to pickle than elements
+        contents = [storage.content_json(av) for av in todo]
+        stored_elements = [j for j, c in enumerate(contents) if c is None]
+        if stored_elements:
+            loaded = storage.load_contents(s, [todo[j] for j in stored_elements])
+            for j, content in zip(stored_elements, loaded):
+                contents[j] = content
+
+        if self._pool is not None:
+            rendered = self._pool.map(
+                render_content, contents, chunksize=self.chunksize
+            )
+        else:
+            rendered = map(render_content, contents)
+
+        for (key, indexes), markdown in zip(missing.items(), rendered):
+            for i in indexes:
+                markdowns[i] = markdown
+            if self.cache is not None and isinstance(key, str):
+                self.cache.put(key, markdown)
+        return markdowns
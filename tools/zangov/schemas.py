@@ -210,7 +210,7 @@ class ContentElement(BaseModel):
 
 
 class DocumentVersion(BaseModel):
-    """Version information for a document."""
+    """Version information for a document, with the fields we persist."""
 
     model_config = ConfigDict(populate_by_name=True)
 
@@ -219,24 +219,34 @@ class DocumentVersion(BaseModel):
     version_date: date = Field(
         ..., alias="versionDate", description="Version effective date"
     )
-    metadata: ActMetadata = Field(..., description="Document metadata")
-    references: list[Any] = Field(
-        default_factory=list, description="References to other documents"
-    )
     changes: list[str] | None = Field(
         default=None, description="List of changes in this version"
     )
     cause: ChangeCause | None = Field(
         default=None, description="Cause of this version (if amended)"
     )
+    imported: bool | None = Field(None, description="Whether version was imported")
+
+
+class FullDocumentVersion(DocumentVersion):
+    """Version information for a document, as returned by the API."""
+
+    metadata: ActMetadata = Field(..., description="Document metadata")
+    references: list[Any] = Field(
+        default_factory=list, description="References to other documents"
+    )
     signature: Signature | None = Field(
         default=None, description="Digital signature information"
     )
-    imported: bool | None = Field(None, description="Whether version was imported")
 
 
 class Document(BaseModel):
-    """Complete document with content."""
+    """
+    Complete document with content, with the fields we persist.
+
+    Fields that are not declared, like the signature container, are skipped
+    by the JSON parser and never become Python objects.
+    """
 
     model_config = ConfigDict(populate_by_name=True)
 
@@ -270,7 +280,6 @@ class Document(BaseModel):
     pages_count: int = Field(
         ..., alias="pagesCount", description="Total number of pages"
     )
-    index: list[dict] | None = Field(default=None, description="Document index")
     temporary_revoked: bool | None = Field(
         None,
         alias="temporaryRevoked",
@@ -284,16 +293,28 @@ class Document(BaseModel):
         return self
 
 
+class FullDocument(Document):
+    """Complete document with content, as returned by the API, for strict validation."""
+
+    version: FullDocumentVersion = Field(..., description="Current version information")
+    index: list[dict] | None = Field(default=None, description="Document index")
+
+
 class VersionInfo(BaseModel):
-    """Simplified version information for version listings."""
+    """Version information in version listings, with the fields we use."""
 
-    model_config = ConfigDict(extra="allow", populate_by_name=True)
+    model_config = ConfigDict(populate_by_name=True)
 
     id: str = Field(..., description="Version ID")
     language: str = Field(..., description="Language code (rus/kaz)")
     version_date: date = Field(
         ..., alias="versionDate", description="Version effective date"
     )
+
+
+class FullVersionInfo(VersionInfo):
+    """Version information in version listings, as returned by the API."""
+
     metadata: ActMetadata = Field(..., description="Document metadata")
     cause: ChangeCause | None = Field(
         default=None, description="Cause of this version (if amended)"
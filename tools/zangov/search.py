@@ -0,0 +1,217 @@
+"""Full-text search over the content elements of act versions.
+
+The plain text of every element is kept once per span of consecutive versions
+of an act that have it, in `search_text`, with a `tsvector` in the text search
+configuration of its language. Russian is stemmed, Kazakh has a configuration
+copied from `simple`. A GIN index answers queries over the whole corpus, hits
+point to the act, the version and the element id.
+
+`build_index` is a batch job over the versions not indexed yet, an act in a
+language is indexed again as a whole when any of its versions is new.
+"""
+
+from datetime import date
+from typing import Iterator
+
+from sqlalchemy import delete, text, update
+from sqlmodel import Session, select
+
+from . import storage
+from .enums import Language
+from .md import normalize_text
+from .models import ActVersion, SearchText, get_engine
+
+TS_CONFIGS = {
+    Language.RUS: "russian",
+    Language.KAZ: "kazakh",
+}
+
+INSERT_TEXTS = text(
+    """
+    INSERT INTO search_text (act_id, language, version_id, element_id,
+        element_type, valid_from, valid_to, text, tsv)
+    SELECT :act_id, :language, t.version_id, t.element_id,
+        t.element_type, t.valid_from, t.valid_to, t.text,
+        to_tsvector(CAST(:config AS regconfig), t.text)
+    FROM unnest(
+        CAST(:version_ids AS integer[]), CAST(:element_ids AS varchar[]),
+        CAST(:element_types AS varchar[]), CAST(:valid_from AS date[]),
+        CAST(:valid_to AS date[]), CAST(:texts AS text[])
+    ) AS t (version_id, element_id, element_type, valid_from, valid_to, text)
+    """
+)
+
+# hits are ranked among the first matches only, so a common word stays fast,
+# `search` tells when there were more
+CANDIDATES = 1000
+
+SEARCH = """
+WITH hits AS (
+    SELECT t.act_id, t.element_id, t.text, t.tsv, {version} AS version_id
+    FROM search_text AS t
+    {join}
+    WHERE t.language = :language AND t.tsv @@ {query} {where}
+    LIMIT :candidates + 1  -- one more tells that there are more
+)
+SELECT a.code, av.id, av.date, h.element_id,
+    ts_headline(CAST(:config AS regconfig), h.text, {query},
+        'MaxFragments=1, MinWords=5, MaxWords=25'),
+    (SELECT count(*) FROM hits) AS matched
+FROM (SELECT * FROM hits LIMIT :candidates) AS h
+JOIN act AS a ON a.id = h.act_id
+JOIN act_version AS av ON av.id = h.version_id
+ORDER BY ts_rank(h.tsv, {query}) DESC
+LIMIT :limit
+"""
+
+_QUERY = "websearch_to_tsquery(CAST(:config AS regconfig), :query)"
+
+# the actual version of the act, the text must be in it
+_ACTUAL = """
+JOIN act_version AS v ON v.act_id = t.act_id AND v.language = t.language
+    AND v.is_actual
+"""
+# the last version of the act by the date, the text must be in it
+_AS_OF = """
+JOIN LATERAL (
+    SELECT id, date FROM act_version
+    WHERE act_id = t.act_id AND language = t.language AND date <= :as_of
+    ORDER BY date DESC LIMIT 1
+) AS v ON true
+"""
+_IN_VERSION = (
+    "AND t.valid_from <= v.date AND (t.valid_to IS NULL OR t.valid_to > v.date)"
+)
+
+
+def element_texts(content: list[dict]) -> dict[tuple[str | None, str], str | None]:
+    """Types of the elements with text by (element id, plain text)."""
+    texts = {}
+    for el in content:
+        plain = normalize_text(el.get("text") or "")
+        if plain:
+            texts[el.get("id"), plain] = el.get("type")
+    return texts
+
+
+def index_act(s: Session, act_id: int, language: Language) -> tuple[int, int]:
+    """
+    Index the element texts of an act in a language, in the session transaction.
+
+    Returns the numbers of versions and of text spans indexed.
+    """
+    versions = s.exec(
+        select(ActVersion.id, ActVersion.date)
+        .where(ActVersion.act_id == act_id, ActVersion.language == language)
+        .order_by(ActVersion.date)
+    ).all()
+
+    spans = []  # (version id, element id, type, valid from, valid to, text)
+    # spans of the texts in the previous version, by (element id, text)
+    open_spans: dict[tuple[str | None, str], tuple[int, str | None, date]] = {}
+    for version_id, day in versions:
+        av = s.get(ActVersion, version_id)
+        texts = element_texts(storage.load_content(s, av))
+        s.expunge(av)  # only one content is held at a time
+        for key in [k for k in open_spans if k not in texts]:
+            first_id, type_, valid_from = open_spans.pop(key)
+            spans.append((first_id, key[0], type_, valid_from, day, key[1]))
+        for key, type_ in texts.items():
+            if key not in open_spans:
+                open_spans[key] = version_id, type_, day
+    for key, (first_id, type_, valid_from) in open_spans.items():
+        spans.append((first_id, key[0], type_, valid_from, None, key[1]))
+
+    s.exec(
+        delete(SearchText).where(
+            SearchText.act_id == act_id, SearchText.language == language
+        )
+    )
+    if spans:
+        columns = list(zip(*spans))
+        s.execute(
+            INSERT_TEXTS,
+            {
+                "act_id": act_id,
+                "language": language.name,  # sa.Enum(native_enum=False) stores names
+                "config": TS_CONFIGS[language],
+                "version_ids": list(columns[0]),
+                "element_ids": list(columns[1]),
+                "element_types": list(columns[2]),
+                "valid_from": list(columns[3]),
+                "valid_to": list(columns[4]),
+                "texts": list(columns[5]),
+            },
+        )
+    s.exec(
+        update(ActVersion)
+        .where(ActVersion.act_id == act_id, ActVersion.language == language)
+        .values(search_indexed=True)
+    )
+    return len(versions), len(spans)
+
+
+def build_index(batch_size: int = 100) -> Iterator[tuple[int, int]]:
+    """
+    Index the acts that have versions not indexed yet, `batch_size` acts per
+    transaction. Yields the numbers of versions and text spans of each batch.
+    """
+    while True:
+        with Session(get_engine()) as s:
+            groups = s.exec(
+                select(ActVersion.act_id, ActVersion.language)
+                .where(~ActVersion.search_indexed)  # in ix_act_version_unindexed
+                .distinct()
+                .limit(batch_size)
+            ).all()
+            if not groups:
+                return
+            indexed = found = 0
+            for act_id, language in groups:
+                versions, spans = index_act(s, act_id, language)
+                indexed += versions
+                found += spans
+            s.commit()
+        yield indexed, found
+
+
+def search(
+    query: str,
+    language: Language = Language.RUS,
+    actual: bool = False,
+    as_of: date | None = None,
+    limit: int = 20,
+    candidates: int = CANDIDATES,
+) -> tuple[list[tuple[str, int, date, str | None, str]], bool]:
+    """
+    Find element texts matching a web search style query.
+
+    With `actual` only the actual versions of acts are searched, with `as_of`
+    the versions in force at that date. Otherwise every text that was ever in
+    an act matches, with the first version that has it.
+
+    Hits are ranked among the first `candidates` matches found, not the best
+    ones of all matches.
+
+    Returns (act code, version id, version date, element id, snippet) of the hits,
+    and whether there were more matches than `candidates`.
+    """
+    params = {
+        "query": query,
+        "language": Language(language).name,
+        "config": TS_CONFIGS[Language(language)],
+        "candidates": candidates,
+        "limit": limit,
+    }
+    if actual:
+        join, where, version = _ACTUAL, _IN_VERSION, "v.id"
+    elif as_of is not None:
+        join, where, version = _AS_OF, _IN_VERSION, "v.id"
+        params["as_of"] = as_of
+    else:
+        join, where, version = "", "", "t.version_id"
+    sql = SEARCH.format(join=join, where=where, version=version, query=_QUERY)
+    with get_engine().connect() as conn:
+        rows = conn.execute(text(sql), params).all()
+    truncated = bool(rows) and rows[0].matched > candidates
+    return [tuple(row)[:-1] for row in rows], truncated
@@ -0,0 +1,244 @@
+"""Storage of act version content.
+
+With `StorageMode.TEXT` a version keeps the JSON of its whole element list.
+With `StorageMode.ELEMENTS` every distinct element is stored once in
+`content_element`, keyed by a hash of its canonical JSON, and a version keeps
+the ordered list of the element hashes. Consecutive versions of an act share
+most of their elements, so this stores only the elements that changed.
+
+Elements are hashed as a whole, including `id` and `changeId`, so the content
+is rebuilt exactly. Unchanged elements keep both of them between versions.
+
+With `StorageMode.ZSTD` a version keeps its JSON compressed with a dictionary
+trained on the corpus, see `zdict`.
+"""
+
+import hashlib
+import json
+from typing import Iterable, Iterator
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from . import zdict
+from .enums import StorageMode
+from .models import ActVersion, get_engine
+
+HASH_SIZE = 16
+
+mode = StorageMode.TEXT
+
+
+def configure(storage_mode: StorageMode):
+    """Choose how the content of new act versions is written."""
+    global mode
+    mode = StorageMode(storage_mode)
+
+
+def element_json(el: dict) -> str:
+    return json.dumps(el, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def element_hash(data: str) -> bytes:
+    return hashlib.blake2b(data.encode(), digest_size=HASH_SIZE).digest()
+
+
+def content_hash(hashes: Iterable[bytes]) -> str:
+    """Hash of a whole content, the same in every storage mode."""
+    return hashlib.blake2b(b"".join(hashes), digest_size=HASH_SIZE).hexdigest()
+
+
+def split_hashes(element_hashes: bytes) -> list[bytes]:
+    return [
+        element_hashes[i : i + HASH_SIZE]
+        for i in range(0, len(element_hashes), HASH_SIZE)
+    ]
+
+
+def store_elements(s: Session, elements: dict[bytes, str]):
+    """Insert elements that are not stored yet, by their hashes."""
+    if not elements:
+        return
+    hashes = list(elements)
+    # ask first, so unchanged elements are never sent to the server again
+    stored = {
+        bytes(h)
+        for (h,) in s.execute(
+            text("SELECT hash FROM content_element WHERE hash = ANY(:hashes)"),
+            {"hashes": hashes},
+        )
+    }
+    missing = [h for h in hashes if h not in stored]
+    if missing:
+        s.execute(
+            text(
+                "INSERT INTO content_element (hash, data) "
+                "SELECT * FROM unnest(CAST(:hashes AS bytea[]), CAST(:data AS text[])) "
+                "ON CONFLICT (hash) DO NOTHING"
+            ),
+            {"hashes": missing, "data": [elements[h] for h in missing]},
+        )
+
+
+class ContentEncoder:
+    """
+    Encode a content page by page into act version column values.
+
+    Only the encoded form of the pages is kept, so a huge content never exists
+    as a single list of elements.
+    """
+
+    def __init__(self, s: Session, storage_mode: StorageMode | None = None):
+        self.s = s
+        self.mode = StorageMode(storage_mode or mode)
+        self.hashes: list[bytes] = []
+        self.size = 0  # encoded bytes held
+
+        self._parts: list = []
+        self._compressor = zdict.compressor() if self.mode == StorageMode.ZSTD else None
+        if self.mode != StorageMode.ELEMENTS:
+            self._write("[")
+
+    def _write(self, fragment: str):
+        if self._compressor is not None:
+            part = self._compressor.compress(fragment.encode())
+        else:
+            part = fragment
+        if part:
+            self._parts.append(part)
+            self.size += len(part)
+
+    def add(self, elements: list[dict]):
+        """Append the elements of the next page."""
+        if not elements:
+            return
+        first = not self.hashes
+        page: dict[bytes, str] = {}
+        for el in elements:
+            data = element_json(el)
+            h = element_hash(data)
+            page[h] = data
+            self.hashes.append(h)
+
+        if self.mode == StorageMode.ELEMENTS:
+            store_elements(self.s, page)
+            self.size += len(elements) * HASH_SIZE
+        else:
+            # the JSON list of a page without its brackets, the same text as
+            # `json.dumps` of the whole content
+            fragment = json.dumps(elements, ensure_ascii=False)[1:-1]
+            self._write(fragment if first else ", " + fragment)
+
+    def values(self) -> dict:
+        """
+        Act version column values for the content, in the storage mode.
+
+        Values are raw database values, compressed content is bytes.
+        """
+        values = {"content_hash": content_hash(self.hashes)}
+        if self.mode == StorageMode.ELEMENTS:
+            values["element_hashes"] = b"".join(self.hashes)
+            return values
+
+        self._write("]")
+        if self._compressor is not None:
+            values["content_zst"] = b"".join(self._parts) + self._compressor.flush()
+        else:
+            values["content"] = "".join(self._parts)
+        return values
+
+
+def encode_content(
+    s: Session, content: list[dict], storage_mode: StorageMode | None = None
+) -> dict:
+    """Act version column values for the content, in the configured storage mode."""
+    encoder = ContentEncoder(s, storage_mode)
+    encoder.add(content)
+    return encoder.values()
+
+
+def load_elements(s: Session, hashes: Iterable[bytes]) -> dict[bytes, dict]:
+    unique = list(set(hashes))
+    if not unique:
+        return {}
+    rows = s.execute(
+        text("SELECT hash, data FROM content_element WHERE hash = ANY(:hashes)"),
+        {"hashes": unique},
+    )
+    return {bytes(h): json.loads(data) for h, data in rows}
+
+
+def content_json(av: ActVersion) -> str | None:
+    """JSON of the content when it is stored whole, None for stored elements."""
+    # content_zst is decompressed by its column type
+    return av.content_zst if av.content_zst is not None else av.content
+
+
+def _load_json(av: ActVersion) -> list[dict]:
+    return json.loads(content_json(av))
+
+
+def load_content(s: Session, av: ActVersion) -> list[dict]:
+    """Rebuild the full element list of an act version from any storage mode."""
+    if av.element_hashes is not None:
+        hashes = split_hashes(av.element_hashes)
+        elements = load_elements(s, hashes)
+        return [elements[h] for h in hashes]
+    return _load_json(av)
+
+
+def load_contents(s: Session, versions: list[ActVersion]) -> list[list[dict]]:
+    """`load_content` for many versions, with one query for all their elements."""
+    hashes = [
+        split_hashes(av.element_hashes) if av.element_hashes is not None else None
+        for av in versions
+    ]
+    elements = load_elements(s, (h for hs in hashes if hs for h in hs))
+    return [
+        [elements[h] for h in hs] if hs is not None else _load_json(av)
+        for av, hs in zip(versions, hashes)
+    ]
+
+
+# a version is stored in a mode when its column is set
+_MODE_COLUMNS = {
+    StorageMode.TEXT: "content",
+    StorageMode.ELEMENTS: "element_hashes",
+    StorageMode.ZSTD: "content_zst",
+}
+
+UPDATE_CONTENT = text(
+    "UPDATE act_version SET content = :content, element_hashes = :element_hashes, "
+    "content_zst = :content_zst, content_hash = :content_hash WHERE id = :id"
+)
+
+
+def convert(storage_mode: StorageMode, batch_size: int = 200) -> Iterator[int]:
+    """
+    Rewrite stored versions into another storage mode, a batch per transaction.
+
+    Yields the number of versions converted by each batch.
+    """
+    column = getattr(ActVersion, _MODE_COLUMNS[storage_mode])
+    last_id = 0
+    while True:
+        with Session(get_engine()) as s:
+            versions = s.exec(
+                select(ActVersion)
+                .where(column.is_(None), ActVersion.id > last_id)
+                .order_by(ActVersion.id)
+                .limit(batch_size)
+            ).all()
+            if not versions:
+                return
+
+            params = []
+            for av, content in zip(versions, load_contents(s, versions)):
+                values = dict.fromkeys(_MODE_COLUMNS.values())
+                values.update(encode_content(s, content, storage_mode))
+                params.append({"id": av.id, **values})
+            s.execute(UPDATE_CONTENT, params)
+            s.commit()
+
+            last_id = versions[-1].id
+            yield len(versions)
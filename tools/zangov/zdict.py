@@ -0,0 +1,116 @@
+"""zstd compression of act version content with trained dictionaries.
+
+Legal Russian and Kazakh text is highly repetitive, so a dictionary trained on
+the corpus compresses a version far better than zstd alone. Dictionaries live in
+the `zstd_dictionary` table. Every frame names its dictionary, so rows compressed
+with an older dictionary stay readable after a new one is trained.
+"""
+
+import json
+import threading
+from compression import zstd
+
+from sqlalchemy import text
+
+# zstd's default dictionary size, larger ones give little on small samples
+DEFAULT_DICT_SIZE = 112_640
+DEFAULT_LEVEL = 9
+
+_lock = threading.Lock()
+_dicts: dict[int, zstd.ZstdDict] = {}
+_current: zstd.ZstdDict | None = None
+_loaded = False
+
+
+def _load():
+    """Read the dictionaries from the database, the newest one compresses."""
+    global _current, _loaded
+    from .models import get_engine
+
+    with get_engine().connect() as conn:
+        rows = conn.execute(
+            text("SELECT id, data FROM zstd_dictionary ORDER BY created_at")
+        ).all()
+    with _lock:
+        for dict_id, data in rows:
+            _dicts[dict_id] = zstd.ZstdDict(bytes(data))
+        if rows:
+            _current = _dicts[rows[-1][0]]
+        _loaded = True
+
+
+def current_dictionary() -> zstd.ZstdDict | None:
+    if not _loaded:
+        _load()
+    return _current
+
+
+def get_dictionary(dict_id: int) -> zstd.ZstdDict:
+    if dict_id not in _dicts:
+        _load()  # trained by another process
+    return _dicts[dict_id]
+
+
+def compress(value: str, level: int = DEFAULT_LEVEL) -> bytes:
+    zd = current_dictionary()
+    return zstd.compress(
+        value.encode(),
+        level=level,
+        zstd_dict=zd.as_digested_dict if zd is not None else None,
+    )
+
+
+def compressor(level: int = DEFAULT_LEVEL) -> zstd.ZstdCompressor:
+    """A streaming `compress`, for content that arrives in parts."""
+    zd = current_dictionary()
+    return zstd.ZstdCompressor(
+        level=level, zstd_dict=zd.as_digested_dict if zd is not None else None
+    )
+
+
+def decompress(data: bytes) -> str:
+    dict_id = zstd.get_frame_info(data).dictionary_id
+    zd = get_dictionary(dict_id) if dict_id else None
+    return zstd.decompress(data, zstd_dict=zd).decode()
+
+
+def train(samples: int = 2000, dict_size: int = DEFAULT_DICT_SIZE) -> tuple[int, int]:
+    """
+    Train a dictionary on random act versions and make it the current one.
+
+    Every content element is a sample, as the dictionary is meant for
+    repeated phrases and JSON structure rather than for whole documents.
+    Returns the dictionary id and the number of samples used.
+    """
+    global _current
+    from sqlmodel import Session, func, select
+
+    from .models import ActVersion, ZstdDictionary, get_engine
+    from .storage import load_contents
+
+    with Session(get_engine()) as s:
+        # pick ids first, the random order never touches the content
+        ids = s.exec(select(ActVersion.id).order_by(func.random()).limit(samples)).all()
+        versions = s.exec(select(ActVersion).where(ActVersion.id.in_(ids))).all()
+        element_samples = [
+            json.dumps(el, ensure_ascii=False).encode()
+            for content in load_contents(s, versions)
+            for el in content
+        ]
+        if not element_samples:
+            raise ValueError("no act versions to train a dictionary on")
+
+        zd = zstd.train_dict(element_samples, dict_size)
+        s.merge(
+            ZstdDictionary(
+                id=zd.dict_id,
+                data=zd.dict_content,
+                samples_count=len(element_samples),
+            )
+        )
+        s.commit()
+
+    with _lock:
+        _dicts[zd.dict_id] = zd
+        _current = zd
+    return zd.dict_id, len(element_samples)